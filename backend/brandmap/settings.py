@@ -29,6 +29,52 @@ GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 QLOO_API_KEY = os.getenv('QLOO_API_KEY')
 QLOO_API_BASE_URL = os.getenv('QLOO_API_BASE_URL', 'https://hackathon.api.qloo.com/v2')
 
+# Admission control for /api/brandmap/ (per worker process)
+BRANDMAP_MAX_IN_FLIGHT = int(os.getenv('BRANDMAP_MAX_IN_FLIGHT', '4'))
+BRANDMAP_MAX_QUEUE = int(os.getenv('BRANDMAP_MAX_QUEUE', '8'))
+BRANDMAP_QUEUE_TIMEOUT = float(os.getenv('BRANDMAP_QUEUE_TIMEOUT', '20'))
+BRANDMAP_MAX_PREVIEW_IN_FLIGHT = int(os.getenv('BRANDMAP_MAX_PREVIEW_IN_FLIGHT', '8'))
+BRANDMAP_MAX_PREVIEW_QUEUE = int(os.getenv('BRANDMAP_MAX_PREVIEW_QUEUE', '16'))
+BRANDMAP_PREVIEW_QUEUE_TIMEOUT = float(os.getenv('BRANDMAP_PREVIEW_QUEUE_TIMEOUT', '10'))
+BRANDMAP_PRIORITY_CLASSES = {"interactive": 0, "batch": 10}
+BRANDMAP_DEFAULT_PRIORITY_CLASS = 'interactive'
+QLOO_MAX_CONCURRENT_CALLS = int(os.getenv('QLOO_MAX_CONCURRENT_CALLS', '16'))
+GEMINI_MAX_CONCURRENT_CALLS = int(os.getenv('GEMINI_MAX_CONCURRENT_CALLS', '8'))
+
+# Upstream usage budgets; 0 means unlimited. Once one is spent, optional sections are skipped
+BRANDMAP_REQUEST_BUDGET = {
+    "gemini_calls": int(os.getenv('BRANDMAP_REQUEST_GEMINI_CALLS', '0')),
+    "qloo_calls": int(os.getenv('BRANDMAP_REQUEST_QLOO_CALLS', '0')),
+    "tokens": int(os.getenv('BRANDMAP_REQUEST_TOKENS', '0')),
+}
+BRANDMAP_MINUTE_BUDGET = {
+    "gemini_calls": int(os.getenv('BRANDMAP_MINUTE_GEMINI_CALLS', '0')),
+    "qloo_calls": int(os.getenv('BRANDMAP_MINUTE_QLOO_CALLS', '0')),
+    "tokens": int(os.getenv('BRANDMAP_MINUTE_TOKENS', '0')),
+}
+BRANDMAP_OPTIONAL_SECTIONS = ["brand_personas", "competitive_analysis", "comparison", "prefetch"]
+
+# Speculative prefetch of country profiles from the form
+BRANDMAP_PROFILE_CACHE_TTL = int(os.getenv('BRANDMAP_PROFILE_CACHE_TTL', str(6 * 60 * 60)))
+BRANDMAP_PREFETCH_WAIT_TIMEOUT = float(os.getenv('BRANDMAP_PREFETCH_WAIT_TIMEOUT', '15'))
+# Prefetch batches (one per /prefetch/ call, covering all of its countries) running at once per worker
+BRANDMAP_MAX_PREFETCH_IN_FLIGHT = int(os.getenv('BRANDMAP_MAX_PREFETCH_IN_FLIGHT', '4'))
+
+REST_FRAMEWORK = {
+    "DEFAULT_THROTTLE_RATES": {
+        "brandmap-prefetch": os.getenv('BRANDMAP_PREFETCH_RATE', '30/min'),
+    },
+}
+
+# Local trending store: rolling window ranked locally, Qloo is only asked for missing days
+BRANDMAP_TRENDING_WINDOW_DAYS = int(os.getenv('BRANDMAP_TRENDING_WINDOW_DAYS', '90'))
+BRANDMAP_TRENDING_TAKE = int(os.getenv('BRANDMAP_TRENDING_TAKE', '20'))
+
+# Record/replay of Qloo and Gemini traffic: 'off', 'record' or 'replay'
+UPSTREAM_CASSETTE_MODE = os.getenv('UPSTREAM_CASSETTE_MODE', 'off')
+UPSTREAM_CASSETTE_DIR = os.getenv('UPSTREAM_CASSETTE_DIR', str(BASE_DIR / 'cassettes'))
+UPSTREAM_CASSETTE_REPLAY_TIMING = os.getenv('UPSTREAM_CASSETTE_REPLAY_TIMING', 'false').lower() == 'true'
+
 
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
@@ -1,3 +1,14 @@
 from django.contrib import admin
+from .models import TrendingEntry, TrendingSync
 
-# Register your models here.
+
+@admin.register(TrendingSync)
+class TrendingSyncAdmin(admin.ModelAdmin):
+    list_display = ("country", "entity_type", "synced_through", "updated_at")
+    list_filter = ("entity_type",)
+
+
+@admin.register(TrendingEntry)
+class TrendingEntryAdmin(admin.ModelAdmin):
+    list_display = ("name", "country", "entity_type", "rank", "start_date", "end_date")
+    list_filter = ("entity_type", "country")
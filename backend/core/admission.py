@@ -0,0 +1,235 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request is shed instead of being admitted."""
+
+    def __init__(self, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class AdmissionController:
+    """Caps in-flight brand maps per worker with a bounded, prioritised wait queue.
+
+    Requests run in their own threads (each with its own event loop), so all
+    state is guarded by a threading.Condition. Lower priority values are served first.
+    """
+
+    def __init__(self, max_in_flight: int, max_queue: int, queue_timeout: float, initial_service_time: float = 30.0):
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._waiting = []
+        self._seq = itertools.count()
+        # Exponentially weighted moving average of how long an admitted request runs
+        self._avg_service_time = initial_service_time
+
+    def _retry_after_locked(self) -> int:
+        """Estimates how long a new arrival would wait for a slot, in whole seconds."""
+        rounds = (len(self._waiting) + 1) / self.max_in_flight
+        return max(1, math.ceil(rounds * self._avg_service_time))
+
+    def retry_after(self) -> int:
+        with self._cond:
+            return self._retry_after_locked()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "in_flight": self._in_flight,
+                "queued": len(self._waiting),
+                "avg_service_time": round(self._avg_service_time, 3),
+            }
+
+    def acquire(self, priority: int = 0) -> None:
+        """Blocks until a slot is free, or raises AdmissionRejected if the request is shed."""
+        with self._cond:
+            if self._in_flight < self.max_in_flight and not self._waiting:
+                self._in_flight += 1
+                return
+
+            if len(self._waiting) >= self.max_queue:
+                raise AdmissionRejected(self._retry_after_locked(), "Admission queue is full.")
+
+            entry = (priority, next(self._seq))
+            heapq.heappush(self._waiting, entry)
+            deadline = time.monotonic() + self.queue_timeout
+
+            while True:
+                if self._in_flight < self.max_in_flight and self._waiting[0] == entry:
+                    heapq.heappop(self._waiting)
+                    self._in_flight += 1
+                    # Let the next waiter re-check in case more than one slot is free
+                    self._cond.notify_all()
+                    return
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                    self._cond.notify_all()
+                    raise AdmissionRejected(self._retry_after_locked(), "Timed out waiting for admission.")
+
+                self._cond.wait(remaining)
+
+    def release(self, service_time: Optional[float] = None) -> None:
+        with self._cond:
+            self._in_flight -= 1
+            if service_time is not None:
+                self._avg_service_time = 0.8 * self._avg_service_time + 0.2 * service_time
+            self._cond.notify_all()
+
+    @contextmanager
+    def admit(self, priority: int = 0):
+        """Context manager wrapping acquire/release that also records the service time."""
+        self.acquire(priority)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def admit_stream(self, iterable, priority: int = 0) -> "AdmittedStream":
+        """Acquires a slot now and holds it until the returned stream is exhausted or closed."""
+        self.acquire(priority)
+        return AdmittedStream(self, iterable)
+
+
+class AdmittedStream:
+    """Iterator for streaming responses that releases its admission slot exactly once.
+
+    The WSGI server calls close() even if iteration never started, which a bare
+    generator's finally block would miss.
+    """
+
+    def __init__(self, controller: AdmissionController, iterable):
+        self._controller = controller
+        self._iterator = iter(iterable)
+        self._started = time.monotonic()
+        self._released = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        try:
+            close = getattr(self._iterator, 'close', None)
+            if close:
+                close()
+        finally:
+            self._controller.release(time.monotonic() - self._started)
+
+
+class UpstreamLimiter:
+    """An async semaphore that can be shared between event loops running in different threads."""
+
+    def __init__(self, name: str, max_concurrent: int):
+        self.name = name
+        self.max_concurrent = max(1, max_concurrent)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._waiters = []
+
+    async def acquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._in_flight < self.max_concurrent and not self._waiters:
+                self._in_flight += 1
+                return
+            future = loop.create_future()
+            self._waiters.append((loop, future))
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                if (loop, future) in self._waiters:
+                    self._waiters.remove((loop, future))
+                    raise
+            # The slot was already handed over; a pending _wake() gives it back otherwise
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self) -> None:
+        with self._lock:
+            while self._waiters:
+                loop, future = self._waiters.pop(0)
+                if loop.is_closed():
+                    continue
+                # The slot is handed straight to the waiter, so _in_flight stays unchanged
+                loop.call_soon_threadsafe(self._wake, future)
+                return
+            self._in_flight -= 1
+
+    def _wake(self, future: asyncio.Future) -> None:
+        if future.done():
+            # The waiter was cancelled after the handover was scheduled
+            self.release()
+        else:
+            future.set_result(None)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+
+def get_request_priority(request) -> int:
+    """Maps the X-BrandMap-Priority header onto a configured priority class."""
+    classes = getattr(settings, 'BRANDMAP_PRIORITY_CLASSES', {"interactive": 0, "batch": 10})
+    default_class = getattr(settings, 'BRANDMAP_DEFAULT_PRIORITY_CLASS', 'interactive')
+    requested = request.headers.get('X-BrandMap-Priority', default_class).strip().lower()
+    return classes.get(requested, classes.get(default_class, 0))
+
+
+admission_controller = AdmissionController(
+    max_in_flight=getattr(settings, 'BRANDMAP_MAX_IN_FLIGHT', 4),
+    max_queue=getattr(settings, 'BRANDMAP_MAX_QUEUE', 8),
+    queue_timeout=getattr(settings, 'BRANDMAP_QUEUE_TIMEOUT', 20.0),
+)
+
+# Previews only call Qloo, so they get more, shorter slots than full brand maps
+preview_controller = AdmissionController(
+    max_in_flight=getattr(settings, 'BRANDMAP_MAX_PREVIEW_IN_FLIGHT', 8),
+    max_queue=getattr(settings, 'BRANDMAP_MAX_PREVIEW_QUEUE', 16),
+    queue_timeout=getattr(settings, 'BRANDMAP_PREVIEW_QUEUE_TIMEOUT', 10.0),
+    initial_service_time=3.0,
+)
+
+# Prefetch is speculative, so it never queues: with max_queue=0 it runs only if a slot is free
+prefetch_controller = AdmissionController(
+    max_in_flight=getattr(settings, 'BRANDMAP_MAX_PREFETCH_IN_FLIGHT', 4),
+    max_queue=0,
+    queue_timeout=0,
+)
+
+qloo_limiter = UpstreamLimiter("qloo", getattr(settings, 'QLOO_MAX_CONCURRENT_CALLS', 16))
+gemini_limiter = UpstreamLimiter("gemini", getattr(settings, 'GEMINI_MAX_CONCURRENT_CALLS', 8))
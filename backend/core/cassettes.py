@@ -0,0 +1,134 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from datetime import date
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from django.conf import settings
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Date params are keyed as offsets from today, so a window recorded one day replays on any
+# later day while a 90-day fetch and a 1-day delta still map to different entries
+DEFAULT_RELATIVE_DATE_PARAMS = ("filter.start_date", "filter.end_date")
+
+
+class Cassette:
+    """Records upstream request/response pairs to disk and serves them back.
+
+    Each interaction is stored as its own JSON file under <directory>/<service>/,
+    named after a hash of the request, so concurrent recorders never share a file.
+    """
+
+    def __init__(self, directory: str, mode: str = "off", replay_timing: bool = False,
+                 relative_date_params=DEFAULT_RELATIVE_DATE_PARAMS):
+        self.directory = str(directory)
+        self.mode = mode
+        self.replay_timing = replay_timing
+        self.relative_date_params = set(relative_date_params)
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record"
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def _relative_date(self, value: Any) -> Any:
+        try:
+            offset = (date.fromisoformat(str(value)) - timezone.localdate()).days
+        except ValueError:
+            return value
+        return f"today{offset:+d}"
+
+    def _key(self, request: Dict[str, Any]) -> str:
+        params = request.get("params")
+        if isinstance(params, dict):
+            request = dict(request, params={
+                k: self._relative_date(v) if k in self.relative_date_params else v
+                for k, v in params.items()
+            })
+        raw = json.dumps(request, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+    def _path(self, service: str, request: Dict[str, Any]) -> str:
+        return os.path.join(self.directory, service, f"{self._key(request)}.json")
+
+    def save(self, service: str, request: Dict[str, Any], response: Any, latency: float,
+             chunks: Optional[List[Tuple[float, Any]]] = None) -> None:
+        """Writes one interaction atomically; failures are logged and never reach the caller.
+
+        For streamed responses, chunks holds (seconds since the request started, chunk) pairs.
+        """
+        path = self._path(service, request)
+        entry = {"request": request, "response": response, "latency": round(latency, 4), "recorded_at": time.time()}
+        if chunks is not None:
+            entry["chunks"] = [[round(offset, 4), chunk] for offset, chunk in chunks]
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f, default=str)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.error(f"Failed to record {service} cassette entry: {e}")
+
+    def load(self, service: str, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        path = self._path(service, request)
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            logger.warning(f"No {service} cassette entry at {path}")
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to read {service} cassette entry {path}: {e}")
+        return None
+
+    def replay(self, service: str, request: Dict[str, Any]) -> Optional[Any]:
+        """Returns the recorded response, sleeping for the recorded latency if configured."""
+        entry = self.load(service, request)
+        if entry is None:
+            return None
+        if self.replay_timing:
+            time.sleep(entry.get("latency", 0))
+        return entry.get("response")
+
+    def replay_stream(self, service: str, request: Dict[str, Any]) -> Iterator[Any]:
+        """Yields a recorded stream chunk by chunk, at the recorded arrival times if configured.
+
+        Entries recorded without chunk timing come back as a single chunk after the full latency.
+        """
+        entry = self.load(service, request)
+        if entry is None:
+            return
+        chunks = entry.get("chunks")
+        if chunks is None:
+            chunks = [[entry.get("latency", 0), entry.get("response")]] if entry.get("response") else []
+        started = time.monotonic()
+        for offset, chunk in chunks:
+            if self.replay_timing:
+                delay = offset - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            yield chunk
+
+    async def replay_async(self, service: str, request: Dict[str, Any]) -> Optional[Any]:
+        """Async variant of replay() that doesn't block the event loop while honouring timing."""
+        entry = self.load(service, request)
+        if entry is None:
+            return None
+        if self.replay_timing:
+            await asyncio.sleep(entry.get("latency", 0))
+        return entry.get("response")
+
+
+cassette = Cassette(
+    directory=getattr(settings, 'UPSTREAM_CASSETTE_DIR', 'cassettes'),
+    mode=getattr(settings, 'UPSTREAM_CASSETTE_MODE', 'off'),
+    replay_timing=getattr(settings, 'UPSTREAM_CASSETTE_REPLAY_TIMING', False),
+)
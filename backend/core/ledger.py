@@ -0,0 +1,232 @@
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Dict, Optional
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_COUNTERS = ("calls", "bytes_sent", "bytes_received", "input_tokens", "output_tokens")
+
+
+class BudgetExceeded(Exception):
+    """Raised instead of making an optional upstream call once a budget is spent."""
+
+
+def _empty_counters() -> Dict[str, int]:
+    return {name: 0 for name in _COUNTERS}
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (about four characters per token) for when Gemini reports no usage."""
+    return (len(text) + 3) // 4 if text else 0
+
+
+class UsageAggregator:
+    """Process-wide upstream usage: lifetime totals plus a sliding one-minute window."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}
+        self._window = deque()
+        self._requests = 0
+
+    def record(self, service: str, counters: Dict[str, int]) -> None:
+        now = time.monotonic()
+        with self._lock:
+            totals = self._totals.setdefault(service, _empty_counters())
+            for name, value in counters.items():
+                totals[name] += value
+            self._window.append((now, service, counters["calls"], counters["input_tokens"] + counters["output_tokens"]))
+            self._trim_locked(now)
+
+    def record_request(self) -> None:
+        with self._lock:
+            self._requests += 1
+
+    def _trim_locked(self, now: float) -> None:
+        while self._window and now - self._window[0][0] > 60:
+            self._window.popleft()
+
+    def last_minute(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            self._trim_locked(time.monotonic())
+            usage = {}
+            for _, service, calls, tokens in self._window:
+                entry = usage.setdefault(service, {"calls": 0, "tokens": 0})
+                entry["calls"] += calls
+                entry["tokens"] += tokens
+            return usage
+
+    def snapshot(self) -> Dict[str, Any]:
+        last_minute = self.last_minute()
+        with self._lock:
+            return {
+                "requests": self._requests,
+                "totals": {service: dict(counters) for service, counters in self._totals.items()},
+                "last_minute": last_minute,
+            }
+
+
+usage_totals = UsageAggregator()
+
+
+class UsageLedger:
+    """Counts upstream calls, bytes and tokens for a single brand map run.
+
+    Usage is broken down per service, per section and per country, and is also
+    forwarded to the process-wide aggregator. Optional sections are refused once
+    the per-request or per-minute budget is spent.
+    """
+
+    def __init__(self, request_budget: Optional[Dict[str, int]] = None, minute_budget: Optional[Dict[str, int]] = None,
+                 optional_sections=(), aggregator: UsageAggregator = usage_totals):
+        self.request_budget = request_budget or {}
+        self.minute_budget = minute_budget or {}
+        self.optional_sections = set(optional_sections)
+        self.aggregator = aggregator
+        self._lock = threading.Lock()
+        self._totals = {}
+        self._by_section = {}
+        self._by_country = {}
+        self._skipped = []
+
+    def record(self, service: str, calls: int = 1, bytes_sent: int = 0, bytes_received: int = 0,
+               input_tokens: int = 0, output_tokens: int = 0) -> None:
+        counters = {
+            "calls": calls,
+            "bytes_sent": bytes_sent,
+            "bytes_received": bytes_received,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+        }
+        section, country = current_scope.get()
+        with self._lock:
+            self._add_locked(service, counters, section, country)
+        self.aggregator.record(service, counters)
+
+    def _add_locked(self, service: str, counters: Dict[str, int], section: Optional[str], country: Optional[str]) -> None:
+        buckets = [self._totals.setdefault(service, _empty_counters())]
+        if section:
+            buckets.append(self._by_section.setdefault(section, {}).setdefault(service, _empty_counters()))
+        if country:
+            buckets.append(self._by_country.setdefault(country, {}).setdefault(service, _empty_counters()))
+        for bucket in buckets:
+            for name, value in counters.items():
+                bucket[name] += value
+
+    def _exceeded_budget_locked(self) -> Optional[str]:
+        gemini = self._totals.get("gemini", _empty_counters())
+        qloo = self._totals.get("qloo", _empty_counters())
+        used = {
+            "gemini_calls": gemini["calls"],
+            "qloo_calls": qloo["calls"],
+            "tokens": gemini["input_tokens"] + gemini["output_tokens"],
+        }
+        for name, limit in self.request_budget.items():
+            if limit and used.get(name, 0) >= limit:
+                return f"per-request {name} budget of {limit}"
+
+        if self.minute_budget:
+            last_minute = self.aggregator.last_minute()
+            used = {
+                "gemini_calls": last_minute.get("gemini", {}).get("calls", 0),
+                "qloo_calls": last_minute.get("qloo", {}).get("calls", 0),
+                "tokens": last_minute.get("gemini", {}).get("tokens", 0),
+            }
+            for name, limit in self.minute_budget.items():
+                if limit and used.get(name, 0) >= limit:
+                    return f"per-minute {name} budget of {limit}"
+        return None
+
+    def _refuse_locked(self, section: str, country: Optional[str]) -> Optional[str]:
+        """Returns the spent budget and notes the skip if the section is optional, else None."""
+        if section not in self.optional_sections:
+            return None
+        exceeded = self._exceeded_budget_locked()
+        if exceeded:
+            self._skipped.append({"section": section, "country": country, "reason": exceeded})
+        return exceeded
+
+    def check_budget(self) -> None:
+        """Raises BudgetExceeded if the current section is optional and a budget is spent."""
+        section, country = current_scope.get()
+        with self._lock:
+            exceeded = self._refuse_locked(section, country)
+        if exceeded:
+            raise BudgetExceeded(f"Skipped {section} after exceeding the {exceeded}.")
+
+    def reserve_call(self, service: str) -> None:
+        """Counts a call before it is made, or raises BudgetExceeded for a refused optional call.
+
+        Checking and counting under one lock means concurrent optional sections see
+        each other's calls, so a run can't overshoot its call budget. Calls reserved
+        here should be recorded afterwards with calls=0.
+        """
+        section, country = current_scope.get()
+        counters = dict(_empty_counters(), calls=1)
+        with self._lock:
+            exceeded = self._refuse_locked(section, country)
+            if not exceeded:
+                self._add_locked(service, counters, section, country)
+        if exceeded:
+            raise BudgetExceeded(f"Skipped {section} after exceeding the {exceeded}.")
+        self.aggregator.record(service, counters)
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "totals": {service: dict(counters) for service, counters in self._totals.items()},
+                "by_section": {section: {s: dict(c) for s, c in usage.items()} for section, usage in self._by_section.items()},
+                "by_country": {country: {s: dict(c) for s, c in usage.items()} for country, usage in self._by_country.items()},
+                "budget": {
+                    "degraded": bool(self._skipped),
+                    "skipped": list(self._skipped),
+                },
+            }
+
+
+current_ledger = contextvars.ContextVar("current_ledger", default=None)
+current_scope = contextvars.ContextVar("current_scope", default=(None, None))
+
+
+def new_ledger(count_request: bool = True) -> UsageLedger:
+    """Creates a ledger configured from settings, by default counting it as one request."""
+    if count_request:
+        usage_totals.record_request()
+    return UsageLedger(
+        request_budget=getattr(settings, 'BRANDMAP_REQUEST_BUDGET', {}),
+        minute_budget=getattr(settings, 'BRANDMAP_MINUTE_BUDGET', {}),
+        optional_sections=getattr(settings, 'BRANDMAP_OPTIONAL_SECTIONS', ()),
+    )
+
+
+def record_usage(service: str, **counters) -> None:
+    """Records usage on the ledger of the current run, if there is one."""
+    ledger = current_ledger.get()
+    if ledger is not None:
+        ledger.record(service, **counters)
+
+
+def check_budget() -> None:
+    ledger = current_ledger.get()
+    if ledger is not None:
+        ledger.check_budget()
+
+
+def reserve_call(service: str) -> None:
+    """Reserves one upstream call on the current run's ledger, if there is one."""
+    ledger = current_ledger.get()
+    if ledger is not None:
+        ledger.reserve_call(service)
+
+
+async def tracked(section: str, country: Optional[str], awaitable: Awaitable) -> Any:
+    """Awaits a coroutine with its upstream usage attributed to a section and country.
+
+    Must run as its own task (e.g. under asyncio.gather) so the scope stays local to it.
+    """
+    current_scope.set((section, country))
+    return await awaitable
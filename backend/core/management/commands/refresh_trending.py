@@ -0,0 +1,38 @@
+import asyncio
+import aiohttp
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand
+from core.models import TrendingSync
+from core.qloo import QlooAPIClient
+from core.trending import refresh_trending
+
+
+class Command(BaseCommand):
+    help = "Delta-syncs the local trending store for every known country, or the given ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument("countries", nargs="*", help="Countries to sync (default: all already in the store)")
+
+    def handle(self, *args, **options):
+        asyncio.run(self._refresh(options["countries"]))
+
+    async def _refresh(self, countries):
+        known = await sync_to_async(
+            lambda: dict(TrendingSync.objects.values_list("country", "location_id"))
+        )()
+        targets = countries or list(known)
+        client = QlooAPIClient()
+
+        timeout = aiohttp.ClientTimeout(total=60)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            for country in targets:
+                location_id = known.get(country)
+                if not location_id:
+                    locations = await client.search_entities(session, query=country, entity_types=["urn:entity:destination", "urn:entity:locality"])
+                    location_id = (locations[0].get('entity_id') or locations[0].get('id')) if locations else None
+                if not location_id:
+                    self.stderr.write(f"Could not find location information for {country}")
+                    continue
+
+                await refresh_trending(client, session, country, location_id)
+                self.stdout.write(f"Refreshed trending data for {country}")
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.4 on 2026-10-19 07:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('country', models.CharField(max_length=100)),
+                ('entity_type', models.CharField(max_length=100)),
+                ('start_date', models.DateField()),
+                ('end_date', models.DateField()),
+                ('entity_id', models.CharField(max_length=200)),
+                ('name', models.CharField(max_length=300)),
+                ('rank', models.PositiveIntegerField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['country', 'entity_type', 'end_date'], name='core_trendi_country_59e9a5_idx')],
+                'constraints': [models.UniqueConstraint(fields=('country', 'entity_type', 'start_date', 'entity_id'), name='unique_trending_entry')],
+            },
+        ),
+        migrations.CreateModel(
+            name='TrendingSync',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('country', models.CharField(max_length=100)),
+                ('location_id', models.CharField(max_length=200)),
+                ('entity_type', models.CharField(max_length=100)),
+                ('synced_through', models.DateField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('country', 'entity_type'), name='unique_trending_sync')],
+            },
+        ),
+    ]
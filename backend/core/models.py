@@ -1,3 +1,43 @@
 from django.db import models
 
-# Create your models here.
+
+class TrendingSync(models.Model):
+    """Tracks how far the local trending store has been synced for a country and entity type."""
+    country = models.CharField(max_length=100)
+    location_id = models.CharField(max_length=200)
+    entity_type = models.CharField(max_length=100)
+    synced_through = models.DateField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["country", "entity_type"], name="unique_trending_sync"),
+        ]
+
+    def __str__(self):
+        return f"{self.country} {self.entity_type} through {self.synced_through}"
+
+
+class TrendingEntry(models.Model):
+    """One entity's rank within a trending bucket covering start_date..end_date (inclusive)."""
+    country = models.CharField(max_length=100)
+    entity_type = models.CharField(max_length=100)
+    start_date = models.DateField()
+    end_date = models.DateField()
+    entity_id = models.CharField(max_length=200)
+    name = models.CharField(max_length=300)
+    rank = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["country", "entity_type", "start_date", "entity_id"],
+                name="unique_trending_entry",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["country", "entity_type", "end_date"]),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.rank} ({self.country}, {self.start_date}..{self.end_date})"
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from django.conf import settings
+from django.core.cache import cache
+from .admission import AdmissionRejected, admission_controller, prefetch_controller
+
+logger = logging.getLogger(__name__)
+
+_inflight = {}
+# Countries whose running prefetch should also warm the cultural analysis once its profile is ready
+_pending_analysis = set()
+_inflight_lock = threading.Lock()
+
+
+def _country_key(country: str) -> str:
+    return country.strip().lower().replace(" ", "_")
+
+
+def profile_cache_key(country: str) -> str:
+    return f"brandmap:profile:{_country_key(country)}"
+
+
+def analysis_cache_key(country: str) -> str:
+    return f"brandmap:cultural_analysis:{_country_key(country)}"
+
+
+def get_cached_profile(country: str) -> Optional[Dict[str, Any]]:
+    return cache.get(profile_cache_key(country))
+
+
+def store_profile(country: str, profile: Dict[str, Any]) -> None:
+    """Caches a successfully built profile; error profiles are never cached."""
+    if profile and not profile.get('error'):
+        cache.set(profile_cache_key(country), profile, getattr(settings, 'BRANDMAP_PROFILE_CACHE_TTL', 6 * 60 * 60))
+
+
+def get_cached_analysis(country: str) -> Optional[Dict[str, Any]]:
+    return cache.get(analysis_cache_key(country))
+
+
+def store_analysis(country: str, analysis: Dict[str, Any]) -> None:
+    """Caches a brand-independent cultural analysis if Gemini actually produced one."""
+    if analysis and analysis.get('analysis') and not analysis.get('error'):
+        cache.set(analysis_cache_key(country), analysis, getattr(settings, 'BRANDMAP_PROFILE_CACHE_TTL', 6 * 60 * 60))
+
+
+async def wait_for_prefetch(country: str) -> None:
+    """Waits briefly for an in-flight prefetch of the same country instead of duplicating its calls."""
+    with _inflight_lock:
+        event = _inflight.get(_country_key(country))
+    if event is not None:
+        timeout = getattr(settings, 'BRANDMAP_PREFETCH_WAIT_TIMEOUT', 15)
+        await asyncio.get_running_loop().run_in_executor(None, event.wait, timeout)
+
+
+def _finish_or_upgrade(key: str, event: threading.Event) -> bool:
+    """Claims a pending analysis request for key, or retires its in-flight entry if there is none."""
+    with _inflight_lock:
+        if key in _pending_analysis:
+            _pending_analysis.discard(key)
+            return True
+        if _inflight.get(key) is event:
+            del _inflight[key]
+        return False
+
+
+def start_prefetch(countries: List[str], include_analysis: bool, worker) -> List[str]:
+    """Runs worker(country, include_analysis) for each country in one background thread.
+
+    Returns the countries that will be warmed. Countries that are already cached or
+    being prefetched are skipped, which makes repeated calls from the form
+    idempotent. If the analysis is asked for while a country's profile prefetch is
+    still running, that prefetch goes on to warm the analysis too. The batch holds a
+    single prefetch slot. Nothing is started while real brand map requests are
+    queueing or every slot is taken, because speculative work must never compete
+    with admitted requests.
+    """
+    wanted = [
+        country for country in countries
+        if not (get_cached_profile(country) and (not include_analysis or get_cached_analysis(country)))
+    ]
+    if not wanted:
+        return []
+
+    if admission_controller.stats()["queued"]:
+        logger.info(f"Skipping prefetch for {', '.join(wanted)}: brand map requests are queueing")
+        return []
+
+    scheduled = []
+    batch = {}
+    with _inflight_lock:
+        for country in wanted:
+            key = _country_key(country)
+            if key in _inflight:
+                if include_analysis:
+                    _pending_analysis.add(key)
+                    scheduled.append(country)
+            elif key not in batch:
+                batch[key] = country
+        if not batch:
+            return scheduled
+        try:
+            prefetch_controller.acquire()
+        except AdmissionRejected:
+            logger.info(f"Skipping prefetch for {', '.join(batch.values())}: all prefetch slots are busy")
+            return scheduled
+        events = {key: threading.Event() for key in batch}
+        _inflight.update(events)
+    scheduled.extend(batch.values())
+
+    async def warm(key: str, country: str):
+        event = events[key]
+        analysis = include_analysis
+        try:
+            while True:
+                try:
+                    await worker(country, analysis)
+                except Exception as e:
+                    logger.error(f"Prefetch failed for {country}: {e}")
+                if analysis or not _finish_or_upgrade(key, event):
+                    break
+                analysis = True
+        finally:
+            with _inflight_lock:
+                if _inflight.get(key) is event:
+                    del _inflight[key]
+                    _pending_analysis.discard(key)
+            event.set()
+
+    async def warm_all():
+        await asyncio.gather(*(warm(key, country) for key, country in batch.items()))
+
+    def run():
+        started = time.monotonic()
+        try:
+            asyncio.run(warm_all())
+        except Exception as e:
+            logger.error(f"Prefetch failed for {', '.join(batch.values())}: {e}")
+        finally:
+            prefetch_controller.release(time.monotonic() - started)
+
+    threading.Thread(target=run, daemon=True).start()
+    return scheduled
@@ -0,0 +1,86 @@
+from itertools import combinations
+from typing import Any, Dict, List
+
+# Profile lists compared in preview mode; "trending" merges every list under profile['trending']
+PREVIEW_DOMAINS = ("music", "fashion", "entertainment", "places", "trending")
+
+
+def _domain_items(profile: Dict[str, Any], domain: str) -> List[str]:
+    if domain == "trending":
+        items = [name for names in profile.get("trending", {}).values() for name in names]
+    else:
+        items = profile.get(domain, [])
+    return [item for item in items if isinstance(item, str)]
+
+
+def _jaccard(a: List[str], b: List[str]) -> float:
+    left = {item.lower() for item in a}
+    right = {item.lower() for item in b}
+    if not left and not right:
+        return 0.0
+    return len(left & right) / len(left | right)
+
+
+def compare_profiles_preview(profiles: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """Compares country profiles deterministically from their Qloo lists, without calling Gemini.
+
+    Each pair of countries is scored by the Jaccard overlap of every domain list and the
+    mean across domains; the summary text is filled in from a fixed template.
+    """
+    valid = {country: profile for country, profile in profiles.items() if profile and not profile.get('error')}
+    if len(valid) < 2:
+        return {
+            "pairs": [],
+            "summary": "At least two country profiles are needed for a comparison.",
+        }
+
+    pairs = []
+    for first, second in combinations(valid, 2):
+        domain_scores = {}
+        for domain in PREVIEW_DOMAINS:
+            a = _domain_items(valid[first], domain)
+            b = _domain_items(valid[second], domain)
+            shared_keys = {item.lower() for item in b}
+            domain_scores[domain] = {
+                "similarity": round(_jaccard(a, b), 3),
+                "shared": [item for item in a if item.lower() in shared_keys],
+            }
+        similarity = sum(score["similarity"] for score in domain_scores.values()) / len(PREVIEW_DOMAINS)
+        pairs.append({
+            "countries": [first, second],
+            "similarity": round(similarity, 3),
+            "domains": domain_scores,
+        })
+
+    # Sort by similarity, then by name, so the output is stable between runs
+    pairs.sort(key=lambda pair: (-pair["similarity"], pair["countries"]))
+    most_similar = pairs[0]
+    most_distinct = pairs[-1]
+
+    if len(pairs) == 1:
+        # A superlative means nothing with a single pair, however low its overlap
+        lines = [
+            f"{most_similar['countries'][0]} and {most_similar['countries'][1]} have "
+            f"{most_similar['similarity']:.0%} average overlap across their Qloo lists.",
+        ]
+    else:
+        lines = [
+            f"{most_similar['countries'][0]} and {most_similar['countries'][1]} are the most culturally similar markets "
+            f"({most_similar['similarity']:.0%} average overlap).",
+            f"{most_distinct['countries'][0]} and {most_distinct['countries'][1]} are the most distinct "
+            f"({most_distinct['similarity']:.0%} average overlap).",
+        ]
+    for pair in pairs:
+        shared = [
+            f"{domain} ({', '.join(score['shared'][:3])})"
+            for domain, score in pair["domains"].items() if score["shared"]
+        ]
+        if shared:
+            lines.append(f"{pair['countries'][0]} and {pair['countries'][1]} share picks in {'; '.join(shared)}.")
+
+    return {
+        "pairs": pairs,
+        "most_similar": most_similar["countries"],
+        "most_distinct": most_distinct["countries"],
+        "summary": " ".join(lines),
+    }
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+from typing import Any, Callable, Dict, Optional
+import aiohttp
+from .ledger import BudgetExceeded, check_budget, current_ledger, current_scope, new_ledger, tracked
+from .prefetch import (
+    get_cached_analysis,
+    get_cached_profile,
+    store_analysis,
+    store_profile,
+    wait_for_prefetch,
+)
+from .qloo import QlooAPIClient
+from .trending import TRENDING_ENTITY_TYPES, get_country_trending
+from .utils import analyze_cultural_profile_async
+
+logger = logging.getLogger(__name__)
+
+
+async def get_country_profiles_async(client: QlooAPIClient, session: aiohttp.ClientSession, brand_info: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Fetches and constructs cultural profiles for each target country concurrently."""
+    tasks = [
+        tracked("profile", country, get_profile_async(client, session, country))
+        for country in brand_info['target_countries']
+    ]
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    profiles = {}
+    for i, country in enumerate(brand_info['target_countries']):
+        result = results[i]
+        if isinstance(result, Exception):
+            logger.error(f"Profile building failed for {country}: {result}")
+            profiles[country] = {"error": f"Failed to build profile for {country}: {str(result)}"}
+        else:
+            profiles[country] = result
+
+    return profiles
+
+
+async def get_profile_async(client: QlooAPIClient, session: aiohttp.ClientSession, country: str) -> Dict[str, Any]:
+    """Returns a prefetched profile if one is cached or in flight, otherwise builds and caches it."""
+    await wait_for_prefetch(country)
+    cached = get_cached_profile(country)
+    if cached:
+        logger.info(f"Using cached profile for {country}")
+        return cached
+
+    profile = await fetch_and_build_profile_async(client, session, country)
+    store_profile(country, profile)
+    return profile
+
+
+async def get_cultural_analysis_async(country: str, profile: Dict[str, Any], on_chunk: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+    """Returns the cached brand-independent cultural analysis, otherwise generates and caches it."""
+    cached = get_cached_analysis(country)
+    if cached:
+        logger.info(f"Using cached cultural analysis for {country}")
+        if on_chunk is not None:
+            on_chunk(cached['analysis'])
+        return cached
+
+    analysis = await analyze_cultural_profile_async(profile, on_chunk)
+    store_analysis(country, analysis)
+    return analysis
+
+
+async def prefetch_country_async(country: str, include_analysis: bool) -> None:
+    """Warms the profile (and optionally the cultural analysis) cache for one country."""
+    current_ledger.set(new_ledger(count_request=False))
+    current_scope.set(("prefetch", country))
+    try:
+        check_budget()
+        profile = get_cached_profile(country)
+        if not profile:
+            timeout = aiohttp.ClientTimeout(total=60)
+            async with aiohttp.ClientSession(timeout=timeout) as session:
+                profile = await fetch_and_build_profile_async(QlooAPIClient(), session, country)
+            store_profile(country, profile)
+
+        if include_analysis and not profile.get('error') and not get_cached_analysis(country):
+            store_analysis(country, await analyze_cultural_profile_async(profile))
+    except BudgetExceeded as e:
+        logger.info(f"Prefetch for {country} skipped: {e}")
+
+
+async def fetch_and_build_profile_async(client: QlooAPIClient, session: aiohttp.ClientSession, country: str) -> Dict[str, Any]:
+    """Fetches data from Qloo and builds a structured cultural profile asynchronously."""
+    try:
+        # 1. Find the location entity for the country
+        locations = await client.search_entities(session, query=country, entity_types=["urn:entity:destination", "urn:entity:locality"])
+        if not locations:
+            logger.warning(f"Could not find location information for {country}")
+            return {"error": f"Could not find location information for {country}."}
+
+        # Get the entity ID from the first result
+        location_entity = locations[0]
+        location_id = location_entity.get('entity_id') or location_entity.get('id')
+        if not location_id:
+            logger.warning(f"No valid entity ID found for {country}")
+            return {"error": f"No valid entity ID found for {country}."}
+
+        logger.info(f"Found location ID for {country}: {location_id}")
+
+        # 2. Build the profile
+        profile = {"country": country, "location_id": location_id}
+
+        # Get insights for different entity types with location signal - run concurrently
+        entity_types = {
+            "music": "urn:entity:artist",
+            "fashion": "urn:entity:brand", 
+            "entertainment": "urn:entity:movie",
+            "places": "urn:entity:place",
+        }
+
+        # Create concurrent tasks for insights
+        insight_tasks = []
+        for domain, entity_type in entity_types.items():
+            task = client.get_insights(
+                session,
+                filter_type=entity_type,
+                signal_location_query=country,
+                take=8
+            )
+            insight_tasks.append((domain, task))
+
+        # Add demographics and trending tasks; trending is read from the local store after a delta sync
+        demographics_task = client.get_demographics(session, signal_entities=[location_id])
+        trending_task = get_country_trending(client, session, country, location_id)
+
+        # Execute all tasks concurrently
+        all_tasks = [task for _, task in insight_tasks] + [demographics_task, trending_task]
+        results = await asyncio.gather(*all_tasks, return_exceptions=True)
+
+        # Process insight results
+        for i, (domain, _) in enumerate(insight_tasks):
+            result = results[i]
+            if isinstance(result, Exception):
+                logger.error(f"Error getting {domain} insights for {country}: {result}")
+                profile[domain] = []
+            else:
+                profile[domain] = []
+                for item in result:
+                    if isinstance(item, dict) and 'name' in item:
+                        profile[domain].append(item['name'])
+                logger.info(f"Got {len(profile[domain])} {domain} insights for {country}")
+
+        # Process demographics result
+        demographics_result = results[-2]
+        if isinstance(demographics_result, Exception):
+            logger.error(f"Error getting demographics for {country}: {demographics_result}")
+            profile['demographics'] = {}
+        else:
+            profile['demographics'] = demographics_result
+
+        # Process trending result
+        trending_result = results[-1]
+        if isinstance(trending_result, Exception):
+            logger.error(f"Error getting trending data for {country}: {trending_result}")
+            profile['trending'] = {domain: [] for domain in TRENDING_ENTITY_TYPES}
+        else:
+            profile['trending'] = trending_result
+            logger.info(f"Got trending data for {country}: " + ", ".join(f"{len(names)} {domain}" for domain, names in trending_result.items()))
+
+        return profile
+
+    except Exception as e:
+        logger.error(f"Error building profile for {country}: {e}")
+        return {"error": f"Error building profile for {country}: {str(e)}"}
@@ -1,8 +1,13 @@
 import aiohttp
 import asyncio
+import json
 import logging
+import time
 from typing import Dict, List, Optional, Any
 from django.conf import settings
+from .admission import qloo_limiter
+from .cassettes import cassette
+from .ledger import record_usage
 
 logger = logging.getLogger(__name__)
 
@@ -20,25 +25,40 @@ class QlooAPIClient:
 
     async def _make_request(self, session: aiohttp.ClientSession, endpoint: str, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Makes an async request to the Qloo API and handles common errors."""
-        if not self.api_key:
+        if not self.api_key and not cassette.replaying:
             logger.warning("QLOO_API_KEY not configured. Skipping API call.")
             return None
 
-        try:
-            # Clean up params - remove None values and convert lists to comma-separated strings
-            clean_params = {}
-            for key, value in params.items():
-                if value is not None:
-                    if isinstance(value, list):
-                        clean_params[key] = ','.join(str(v) for v in value)
-                    else:
-                        clean_params[key] = value
+        # Clean up params - remove None values and convert lists to comma-separated strings
+        clean_params = {}
+        for key, value in params.items():
+            if value is not None:
+                if isinstance(value, list):
+                    clean_params[key] = ','.join(str(v) for v in value)
+                else:
+                    clean_params[key] = value
+
+        cassette_request = {"endpoint": endpoint, "params": clean_params}
+        if cassette.replaying:
+            # Replays queue on the same limiter, so recorded latencies show production contention
+            async with qloo_limiter:
+                data = await cassette.replay_async("qloo", cassette_request)
+            record_usage("qloo", bytes_received=len(json.dumps(data)) if data is not None else 0)
+            return data
 
+        try:
             url = f"{self.base_url}/{endpoint}"
-            async with session.get(url, params=clean_params, headers=self.headers, timeout=aiohttp.ClientTimeout(total=15)) as response:
-                logger.info(f"Qloo API request: {response.url}")
-                response.raise_for_status()
-                return await response.json()
+            async with qloo_limiter:
+                started = time.monotonic()
+                async with session.get(url, params=clean_params, headers=self.headers, timeout=aiohttp.ClientTimeout(total=15)) as response:
+                    logger.info(f"Qloo API request: {response.url}")
+                    body = await response.read()
+                    record_usage("qloo", bytes_sent=len(str(response.url)), bytes_received=len(body))
+                    response.raise_for_status()
+                    data = await response.json()
+                if cassette.recording:
+                    cassette.save("qloo", cassette_request, data, time.monotonic() - started)
+                return data
         except asyncio.TimeoutError:
             logger.error(f"Qloo API request timeout for {endpoint}")
             return None
@@ -82,19 +102,22 @@ class QlooAPIClient:
                 return results.get('demographics', [])
         return {}
 
-    async def get_trending(self, session: aiohttp.ClientSession, filter_type: str, signal_entities: List[str], start_date: str, end_date: str) -> List[Dict[str, Any]]:
-        """Gets trending data using the v2/trending endpoint."""
+    async def get_trending(self, session: aiohttp.ClientSession, filter_type: str, signal_entities: List[str], start_date: str, end_date: str, take: int = 8) -> Optional[List[Dict[str, Any]]]:
+        """Gets trending data using the v2/trending endpoint.
+
+        Returns None if the request failed, so callers can tell errors from an empty result.
+        """
         params = {
             "filter.type": filter_type,
             "signal.interests.entities": signal_entities,
             "filter.start_date": start_date,
             "filter.end_date": end_date,
-            "take": 8,
+            "take": take,
         }
         data = await self._make_request(session, "v2/trending", params)
         if data and data.get('success') and 'results' in data:
-            return data['results']
-        return []
+            return data['results'] or []
+        return None
 
     async def get_location_insights(self, session: aiohttp.ClientSession, location_query: str, filter_type: str = "urn:entity:place") -> List[Dict[str, Any]]:
         """Gets location-based insights."""
@@ -25,3 +25,14 @@ class BrandMapRequestSerializer(serializers.Serializer):
         if not value:
             raise serializers.ValidationError("At least one target country is required.")
         return value
+
+
+class BrandMapPrefetchSerializer(serializers.Serializer):
+    """Serializer for warming country profiles while the form is still being filled in."""
+    target_countries = serializers.ListField(
+        child=serializers.CharField(max_length=100),
+        allow_empty=False,
+        min_length=1,
+        max_length=5
+    )
+    include_analysis = serializers.BooleanField(default=False)
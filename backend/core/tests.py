@@ -1 +1,673 @@
-from django.test import TestCase
\ No newline at end of file
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+import aiohttp
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+from .admission import (
+    AdmissionController,
+    AdmissionRejected,
+    AdmittedStream,
+    UpstreamLimiter,
+    admission_controller,
+    gemini_limiter,
+)
+from .cassettes import Cassette, cassette
+from .models import TrendingEntry, TrendingSync
+from .prefetch import _inflight, start_prefetch, store_profile
+from .preview import compare_profiles_preview
+from .qloo import QlooAPIClient
+from .trending import get_trending_rankings, refresh_trending
+from .utils import generate_gemini_response_async
+from .views import BrandMapAPIView
+
+CASSETTE_FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "cassettes")
+
+BRAND_INFO = {
+    "brand_name": "EcoStyle",
+    "brand_description": "Sustainable fashion brand focusing on eco-friendly materials and ethical manufacturing.",
+    "origin_country": "United States",
+    "target_countries": ["Japan", "Germany"],
+    "brand_keywords": ["sustainable", "eco-friendly"],
+    "competitors": ["Patagonia"],
+}
+
+
+def wait_until(predicate, timeout=2.0):
+    """Polls predicate until it is true, failing the test if it never becomes true."""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("Condition was not met in time")
+        time.sleep(0.005)
+
+
+class AdmissionControllerTests(SimpleTestCase):
+
+    def test_admits_waiters_in_priority_order(self):
+        controller = AdmissionController(max_in_flight=1, max_queue=4, queue_timeout=5)
+        controller.acquire()
+        admitted = []
+
+        def waiter(priority):
+            controller.acquire(priority)
+            admitted.append(priority)
+            controller.release()
+
+        batch = threading.Thread(target=waiter, args=(10,))
+        batch.start()
+        wait_until(lambda: controller.stats()["queued"] == 1)
+        interactive = threading.Thread(target=waiter, args=(0,))
+        interactive.start()
+        wait_until(lambda: controller.stats()["queued"] == 2)
+
+        controller.release()
+        batch.join(2)
+        interactive.join(2)
+
+        self.assertEqual(admitted, [0, 10])
+        self.assertEqual(controller.stats()["in_flight"], 0)
+
+    def test_sheds_when_queue_is_full(self):
+        controller = AdmissionController(max_in_flight=1, max_queue=0, queue_timeout=5)
+        controller.acquire()
+
+        with self.assertRaises(AdmissionRejected) as ctx:
+            controller.acquire()
+
+        self.assertEqual(ctx.exception.reason, "Admission queue is full.")
+        self.assertGreaterEqual(ctx.exception.retry_after, 1)
+        self.assertEqual(controller.stats()["in_flight"], 1)
+
+    def test_sheds_after_queue_timeout(self):
+        controller = AdmissionController(max_in_flight=1, max_queue=1, queue_timeout=0.05)
+        controller.acquire()
+
+        with self.assertRaises(AdmissionRejected) as ctx:
+            controller.acquire()
+
+        self.assertEqual(ctx.exception.reason, "Timed out waiting for admission.")
+        self.assertEqual(controller.stats()["queued"], 0)
+
+    def test_retry_after_follows_queue_and_service_time(self):
+        controller = AdmissionController(max_in_flight=2, max_queue=4, queue_timeout=5, initial_service_time=10)
+        self.assertEqual(controller.retry_after(), 5)
+
+        controller.acquire()
+        controller.release(service_time=20)
+        self.assertEqual(controller.stats()["avg_service_time"], 12.0)
+        self.assertEqual(controller.retry_after(), 6)
+
+    def test_admit_releases_on_error(self):
+        controller = AdmissionController(max_in_flight=1, max_queue=0, queue_timeout=5)
+
+        with self.assertRaises(ValueError):
+            with controller.admit():
+                raise ValueError("boom")
+
+        self.assertEqual(controller.stats()["in_flight"], 0)
+
+
+class AdmittedStreamTests(SimpleTestCase):
+
+    def test_close_without_iterating_releases_slot(self):
+        controller = AdmissionController(max_in_flight=1, max_queue=0, queue_timeout=5)
+        closed = []
+
+        def events():
+            try:
+                yield b"one"
+            finally:
+                closed.append(True)
+
+        stream = controller.admit_stream(events())
+        self.assertIsInstance(stream, AdmittedStream)
+        self.assertEqual(controller.stats()["in_flight"], 1)
+
+        stream.close()
+        stream.close()
+        self.assertEqual(controller.stats()["in_flight"], 0)
+
+    def test_exhausting_stream_releases_slot_once(self):
+        controller = AdmissionController(max_in_flight=1, max_queue=0, queue_timeout=5)
+        stream = controller.admit_stream(iter([b"one", b"two"]))
+
+        self.assertEqual(list(stream), [b"one", b"two"])
+        stream.close()
+        self.assertEqual(controller.stats()["in_flight"], 0)
+
+    def test_closing_stream_closes_generator(self):
+        controller = AdmissionController(max_in_flight=1, max_queue=0, queue_timeout=5)
+        closed = []
+
+        def events():
+            try:
+                yield b"one"
+                yield b"two"
+            finally:
+                closed.append(True)
+
+        stream = controller.admit_stream(events())
+        next(stream)
+        stream.close()
+
+        self.assertEqual(closed, [True])
+        self.assertEqual(controller.stats()["in_flight"], 0)
+
+
+class UpstreamLimiterTests(SimpleTestCase):
+
+    def test_limits_calls_across_event_loops(self):
+        limiter = UpstreamLimiter("test", 2)
+        lock = threading.Lock()
+        counters = {"current": 0, "peak": 0, "done": 0}
+
+        async def call():
+            async with limiter:
+                with lock:
+                    counters["current"] += 1
+                    counters["peak"] = max(counters["peak"], counters["current"])
+                await asyncio.sleep(0.01)
+                with lock:
+                    counters["current"] -= 1
+                    counters["done"] += 1
+
+        async def worker():
+            await asyncio.gather(*(call() for _ in range(5)))
+
+        threads = [threading.Thread(target=asyncio.run, args=(worker(),)) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(counters["done"], 15)
+        self.assertLessEqual(counters["peak"], 2)
+        self.assertEqual(limiter._in_flight, 0)
+        self.assertEqual(limiter._waiters, [])
+
+    def test_cancelled_waiter_leaves_queue(self):
+        limiter = UpstreamLimiter("test", 1)
+
+        async def scenario():
+            await limiter.acquire()
+            waiter = asyncio.ensure_future(limiter.acquire())
+            await asyncio.sleep(0)
+            self.assertEqual(len(limiter._waiters), 1)
+
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+            self.assertEqual(limiter._waiters, [])
+            limiter.release()
+
+        asyncio.run(scenario())
+        self.assertEqual(limiter._in_flight, 0)
+
+    def test_cancel_before_handover_runs_returns_slot(self):
+        limiter = UpstreamLimiter("test", 1)
+
+        async def scenario():
+            await limiter.acquire()
+            waiter = asyncio.ensure_future(limiter.acquire())
+            await asyncio.sleep(0)
+
+            # The slot is handed over, but the waiter is cancelled before the loop delivers it
+            limiter.release()
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+
+        asyncio.run(scenario())
+        self.assertEqual(limiter._in_flight, 0)
+        self.assertEqual(limiter._waiters, [])
+
+    def test_cancel_after_handover_returns_slot(self):
+        limiter = UpstreamLimiter("test", 1)
+
+        async def scenario():
+            await limiter.acquire()
+            waiter = asyncio.ensure_future(limiter.acquire())
+            await asyncio.sleep(0)
+
+            # Let the handover complete, then cancel before the waiter resumes
+            limiter.release()
+            await asyncio.sleep(0)
+            waiter.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiter
+
+        asyncio.run(scenario())
+        self.assertEqual(limiter._in_flight, 0)
+
+
+class PreviewComparisonTests(SimpleTestCase):
+
+    PROFILES = {
+        "Japan": {
+            "music": ["Hikaru Utada", "YOASOBI"],
+            "fashion": ["Uniqlo"],
+            "trending": {"music": ["Ado"], "fashion": []},
+        },
+        "Germany": {
+            "music": ["yoasobi", "Kraftwerk"],
+            "fashion": ["Uniqlo"],
+            "trending": {"music": ["Ado"]},
+        },
+        "Brazil": {"music": ["Anitta"], "places": ["Copacabana"]},
+    }
+
+    def test_scores_pairs_and_orders_them_stably(self):
+        comparison = compare_profiles_preview(self.PROFILES)
+
+        self.assertEqual(
+            [pair["countries"] for pair in comparison["pairs"]],
+            [["Japan", "Germany"], ["Germany", "Brazil"], ["Japan", "Brazil"]],
+        )
+        top = comparison["pairs"][0]
+        # music 1/3, fashion 1, entertainment 0, places 0, trending 1, averaged over five domains
+        self.assertEqual(top["similarity"], 0.467)
+        self.assertEqual(top["domains"]["music"], {"similarity": 0.333, "shared": ["YOASOBI"]})
+        self.assertEqual(top["domains"]["trending"]["shared"], ["Ado"])
+        self.assertEqual(comparison["most_similar"], ["Japan", "Germany"])
+        self.assertEqual(comparison["most_distinct"], ["Japan", "Brazil"])
+        self.assertIn("Japan and Germany are the most culturally similar markets (47% average overlap).", comparison["summary"])
+        self.assertEqual(compare_profiles_preview(self.PROFILES), comparison)
+
+    def test_single_pair_has_no_superlative(self):
+        profiles = {country: self.PROFILES[country] for country in ("Japan", "Brazil")}
+
+        summary = compare_profiles_preview(profiles)["summary"]
+
+        self.assertEqual(summary, "Japan and Brazil have 0% average overlap across their Qloo lists.")
+
+    def test_needs_two_valid_profiles(self):
+        comparison = compare_profiles_preview({"Japan": self.PROFILES["Japan"], "Germany": {"error": "No location"}})
+
+        self.assertEqual(comparison["pairs"], [])
+
+
+class StartPrefetchTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.slots = AdmissionController(max_in_flight=2, max_queue=0, queue_timeout=0)
+        patcher = mock.patch("core.prefetch.prefetch_controller", self.slots)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.gate = threading.Event()
+        self.addCleanup(self.gate.set)
+        self.calls = []
+
+    async def worker(self, country, include_analysis):
+        self.calls.append((country, include_analysis))
+        await asyncio.get_running_loop().run_in_executor(None, self.gate.wait, 2)
+
+    def finish(self):
+        self.gate.set()
+        wait_until(lambda: not _inflight and self.slots.stats()["in_flight"] == 0)
+
+    def test_repeated_calls_are_idempotent(self):
+        self.assertEqual(start_prefetch(["Japan"], False, self.worker), ["Japan"])
+        self.assertEqual(start_prefetch(["Japan", "japan"], False, self.worker), [])
+        self.finish()
+
+        self.assertEqual(self.calls, [("Japan", False)])
+
+    def test_skips_cached_profiles(self):
+        store_profile("Japan", {"country": "Japan", "music": ["YOASOBI"]})
+
+        self.assertEqual(start_prefetch(["Japan"], False, self.worker), [])
+        self.assertEqual(self.calls, [])
+
+    def test_analysis_request_upgrades_running_profile_prefetch(self):
+        start_prefetch(["Japan"], False, self.worker)
+        wait_until(lambda: self.calls)
+
+        scheduled = start_prefetch(["Japan", "Germany", "Brazil"], True, self.worker)
+        self.finish()
+
+        self.assertEqual(scheduled, ["Japan", "Germany", "Brazil"])
+        self.assertCountEqual(self.calls, [("Japan", False), ("Japan", True), ("Germany", True), ("Brazil", True)])
+
+    def test_batch_holds_a_single_slot(self):
+        start_prefetch(["Japan", "Germany", "Brazil", "Mexico", "India"], True, self.worker)
+        wait_until(lambda: len(self.calls) == 5)
+
+        self.assertEqual(self.slots.stats()["in_flight"], 1)
+        self.finish()
+
+    def test_sheds_when_slots_are_busy(self):
+        self.slots.acquire()
+        self.slots.acquire()
+
+        self.assertEqual(start_prefetch(["Japan"], True, self.worker), [])
+        self.assertEqual(_inflight, {})
+        self.slots.release()
+        self.slots.release()
+
+    def test_skips_while_brand_maps_are_queued(self):
+        queued = mock.Mock()
+        queued.stats.return_value = {"in_flight": 4, "queued": 1, "avg_service_time": 30.0}
+
+        with mock.patch("core.prefetch.admission_controller", queued):
+            self.assertEqual(start_prefetch(["Japan"], True, self.worker), [])
+
+        self.assertEqual(self.calls, [])
+        self.assertEqual(self.slots.stats()["in_flight"], 0)
+
+
+class CassetteTests(SimpleTestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.directory = tmp.name
+
+    def test_stream_replay_keeps_chunk_timing(self):
+        recorder = Cassette(self.directory, mode="record")
+        request = {"model": "test", "prompt": "hello"}
+        recorder.save("gemini", request, "ab", 0.2, chunks=[(0.1, "a"), (0.2, "b")])
+
+        player = Cassette(self.directory, mode="replay", replay_timing=True)
+        started = time.monotonic()
+        arrivals = [(chunk, time.monotonic() - started) for chunk in player.replay_stream("gemini", request)]
+
+        self.assertEqual([chunk for chunk, _ in arrivals], ["a", "b"])
+        self.assertGreaterEqual(arrivals[0][1], 0.09)
+        self.assertLess(arrivals[0][1], 0.19)
+        self.assertGreaterEqual(arrivals[1][1], 0.19)
+
+    def test_stream_replay_without_chunks_is_one_chunk(self):
+        request = {"model": "test", "prompt": "hello"}
+        Cassette(self.directory, mode="record").save("gemini", request, "ab", 0.2)
+
+        player = Cassette(self.directory, mode="replay")
+        self.assertEqual(list(player.replay_stream("gemini", request)), ["ab"])
+
+    def test_qloo_replay_is_bounded_by_limiter(self):
+        params = {"query": "Japan", "types": "urn:entity:destination", "take": 5}
+        Cassette(self.directory, mode="record").save(
+            "qloo", {"endpoint": "search", "params": params}, {"results": []}, 0.1,
+        )
+        patches = [
+            mock.patch.object(cassette, "mode", "replay"),
+            mock.patch.object(cassette, "directory", self.directory),
+            mock.patch.object(cassette, "replay_timing", True),
+            mock.patch("core.qloo.qloo_limiter", UpstreamLimiter("test", 1)),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        async def scenario():
+            client = QlooAPIClient()
+            return await asyncio.gather(*(client._make_request(None, "search", params) for _ in range(3)))
+
+        started = time.monotonic()
+        results = asyncio.run(scenario())
+
+        self.assertEqual(results, [{"results": []}] * 3)
+        self.assertGreaterEqual(time.monotonic() - started, 0.3)
+
+
+class FakeGeminiStream:
+    """Stands in for a streamed generate_content() response, emitting a chunk every delay seconds."""
+
+    def __init__(self, count: int, delay: float):
+        self.count = count
+        self.delay = delay
+        self.produced = 0
+        self.cancelled = threading.Event()
+        self._iterator = self
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def __iter__(self):
+        for i in range(self.count):
+            time.sleep(self.delay)
+            self.produced += 1
+            yield mock.Mock(text=f"chunk{i} ", usage_metadata=None)
+
+
+class GeminiStreamingTests(SimpleTestCase):
+
+    def setUp(self):
+        self.limiter = UpstreamLimiter("test", 1)
+        patches = [
+            mock.patch.object(cassette, "mode", "off"),
+            mock.patch("core.utils.gemini_limiter", self.limiter),
+            mock.patch("core.utils.genai.GenerativeModel"),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def use_stream(self, stream: FakeGeminiStream) -> None:
+        from . import utils
+        utils.genai.GenerativeModel.return_value.generate_content.return_value = stream
+
+    def test_streamed_chunks_are_forwarded_and_aggregated(self):
+        stream = FakeGeminiStream(count=3, delay=0)
+        self.use_stream(stream)
+        received = []
+
+        result = asyncio.run(generate_gemini_response_async("prompt", on_chunk=received.append))
+
+        self.assertEqual(received, ["chunk0 ", "chunk1 ", "chunk2 "])
+        self.assertEqual(result, "chunk0 chunk1 chunk2 ")
+        self.assertFalse(stream.cancelled.is_set())
+        self.assertEqual(self.limiter._in_flight, 0)
+
+    def test_cancelling_stops_upstream_stream_without_blocking_loop(self):
+        stream = FakeGeminiStream(count=20, delay=0.05)
+        self.use_stream(stream)
+
+        async def scenario():
+            gaps = []
+
+            async def heartbeat():
+                last = time.monotonic()
+                while True:
+                    await asyncio.sleep(0.01)
+                    now = time.monotonic()
+                    gaps.append(now - last)
+                    last = now
+
+            beat = asyncio.ensure_future(heartbeat())
+            task = asyncio.ensure_future(generate_gemini_response_async("prompt", on_chunk=lambda text: None))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            cancelled_at = time.monotonic()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            elapsed = time.monotonic() - cancelled_at
+            # The slot is only given back once the worker has exited
+            produced = stream.produced
+            self.assertEqual(self.limiter._in_flight, 0)
+            beat.cancel()
+            return elapsed, max(gaps), produced
+
+        elapsed, longest_gap, produced = asyncio.run(scenario())
+        time.sleep(0.2)
+
+        self.assertTrue(stream.cancelled.is_set())
+        self.assertLess(produced, 20)
+        self.assertEqual(stream.produced, produced)
+        self.assertLess(elapsed, 0.5)
+        self.assertLess(longest_gap, 0.5)
+
+
+class BrandMapLoadSheddingTests(TestCase):
+
+    def test_shed_request_gets_retry_after(self):
+        controller = AdmissionController(max_in_flight=1, max_queue=0, queue_timeout=5, initial_service_time=7)
+        controller.acquire()
+
+        with mock.patch("core.views.admission_controller", controller), self.settings(ALLOWED_HOSTS=["*"]):
+            response = self.client.post("/api/brandmap/", BRAND_INFO, content_type="application/json")
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Retry-After"], "7")
+        self.assertEqual(response.json()["retry_after"], 7)
+
+
+class BrandMapReplayTests(TransactionTestCase):
+    """Runs the full pipeline against the cassettes in core/fixtures/cassettes.
+
+    The fixtures are synthetic responses saved for the exact requests this code
+    makes, with trending dates keyed relative to the day they were recorded.
+    TransactionTestCase is used because the trending store is written from
+    sync_to_async worker threads.
+    """
+
+    def setUp(self):
+        self._cassette_state = (cassette.mode, cassette.directory, cassette.replay_timing)
+        cassette.mode = "replay"
+        cassette.directory = CASSETTE_FIXTURES
+        cassette.replay_timing = False
+        cache.clear()
+
+    def tearDown(self):
+        cassette.mode, cassette.directory, cassette.replay_timing = self._cassette_state
+        cache.clear()
+
+    def test_brand_map_replays_from_cassettes(self):
+        result = asyncio.run(BrandMapAPIView()._process_brand_map_async(dict(BRAND_INFO)))
+
+        for country in BRAND_INFO["target_countries"]:
+            self.assertTrue(result["cultural_analysis"][country]["analysis"].startswith(f"{country} values"))
+            self.assertIn(country, result["brand_strategies"][country]["strategy"])
+            self.assertIn(country, result["brand_personas"][country]["persona"])
+            self.assertIn(country, result["competitive_analysis"][country]["competitive_analysis"])
+        self.assertTrue(result["comparison"]["comparison"].startswith("Japan and Germany"))
+
+        usage = result["metadata"]["usage"]
+        self.assertEqual(usage["totals"]["gemini"]["calls"], 9)
+        self.assertEqual(usage["totals"]["qloo"]["calls"], 20)
+        self.assertFalse(usage["budget"]["degraded"])
+
+        yesterday = timezone.localdate() - timedelta(days=1)
+        syncs = TrendingSync.objects.all()
+        self.assertEqual(syncs.count(), 8)
+        self.assertTrue(all(sync.synced_through == yesterday for sync in syncs))
+        self.assertEqual(get_trending_rankings("Japan", "urn:entity:artist"), ["YOASOBI", "Ado", "Fujii Kaze"])
+
+    def test_trending_delta_is_stored_as_its_own_bucket(self):
+        asyncio.run(BrandMapAPIView()._process_brand_map_async(dict(BRAND_INFO)))
+        today = timezone.localdate()
+        yesterday = today - timedelta(days=1)
+        # Pretend the initial sync ran a day earlier, so only yesterday is missing
+        TrendingSync.objects.filter(country="Japan").update(synced_through=today - timedelta(days=2))
+        location_id = TrendingSync.objects.filter(country="Japan").first().location_id
+
+        async def refresh():
+            async with aiohttp.ClientSession() as session:
+                await refresh_trending(QlooAPIClient(), session, "Japan", location_id, today)
+
+        asyncio.run(refresh())
+
+        delta = TrendingEntry.objects.filter(country="Japan", start_date=yesterday, end_date=yesterday)
+        self.assertEqual(delta.count(), 4)
+        window = TrendingEntry.objects.filter(country="Japan", start_date=today - timedelta(days=90))
+        self.assertEqual(window.count(), 12)
+        self.assertTrue(all(sync.synced_through == yesterday for sync in TrendingSync.objects.filter(country="Japan")))
+        self.assertEqual(get_trending_rankings("Japan", "urn:entity:artist")[:2], ["YOASOBI", "Ado"])
+
+    def test_stream_endpoint_emits_deltas_then_result(self):
+        response = self.client.post("/api/brandmap/?stream=1", BRAND_INFO, content_type="application/json")
+        events = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        response.close()
+
+        deltas = [event for event in events if event["event"] == "delta"]
+        sections = {(event["section"], event["country"]) for event in deltas}
+        expected = {
+            (section, country)
+            for section in ("cultural_analysis", "brand_strategies", "brand_personas", "competitive_analysis")
+            for country in BRAND_INFO["target_countries"]
+        }
+        self.assertEqual(sections, expected | {("comparison", None)})
+
+        self.assertEqual(events[-1]["event"], "result")
+        result = events[-1]["data"]
+        japan = [e["delta"] for e in deltas if e["section"] == "cultural_analysis" and e["country"] == "Japan"]
+        self.assertEqual(len(japan), 3)
+        self.assertEqual(result["cultural_analysis"]["Japan"]["analysis"], "".join(japan))
+        self.assertEqual(result["metadata"]["usage"]["totals"]["gemini"]["calls"], 9)
+        self.assertEqual(admission_controller.stats()["in_flight"], 0)
+
+    def test_stream_disconnect_stops_upstream_and_releases_slot(self):
+        started = []
+        produced = []
+        closed = []
+
+        def slow_stream(prompt):
+            started.append(prompt)
+            try:
+                for i in range(20):
+                    time.sleep(0.05)
+                    produced.append(i)
+                    yield f"chunk{i} "
+            finally:
+                closed.append(prompt)
+
+        with mock.patch("core.utils.stream_gemini_response", slow_stream):
+            response = self.client.post("/api/brandmap/?stream=1", BRAND_INFO, content_type="application/json")
+            first = json.loads(next(iter(response.streaming_content)))
+            disconnected_at = time.monotonic()
+            response.close()
+            elapsed = time.monotonic() - disconnected_at
+            produced_at_close = len(produced)
+            time.sleep(0.2)
+
+        self.assertEqual(first["event"], "delta")
+        self.assertLess(elapsed, 0.5)
+        self.assertEqual(len(produced), produced_at_close)
+        self.assertLess(len(produced), 20 * len(started))
+        self.assertEqual(len(closed), len(started))
+        self.assertEqual(admission_controller.stats()["in_flight"], 0)
+        self.assertEqual(gemini_limiter._in_flight, 0)
+
+    def test_request_budget_caps_gemini_calls_and_skips_optional_sections(self):
+        from . import utils
+        replay = utils.generate_gemini_response
+
+        def slow_replay(prompt):
+            # Give calls some latency so concurrent sections overlap, as they do against the live API
+            time.sleep(0.05)
+            return replay(prompt)
+
+        with self.settings(BRANDMAP_REQUEST_BUDGET={"gemini_calls": 5}), \
+                mock.patch("core.utils.generate_gemini_response", slow_replay):
+            result = asyncio.run(BrandMapAPIView()._process_brand_map_async(dict(BRAND_INFO)))
+
+        usage = result["metadata"]["usage"]
+        self.assertEqual(usage["totals"]["gemini"]["calls"], 5)
+        self.assertTrue(usage["budget"]["degraded"])
+
+        # Cultural analyses and strategies are required, so they always run
+        for country in BRAND_INFO["target_countries"]:
+            self.assertTrue(result["cultural_analysis"][country]["analysis"])
+            self.assertTrue(result["brand_strategies"][country]["strategy"])
+
+        optional = {
+            ("brand_personas", country) for country in BRAND_INFO["target_countries"]
+        } | {
+            ("competitive_analysis", country) for country in BRAND_INFO["target_countries"]
+        } | {("comparison", None)}
+        skipped = {(entry["section"], entry["country"]) for entry in usage["budget"]["skipped"]}
+        self.assertEqual(len(usage["budget"]["skipped"]), 4)
+        self.assertLessEqual(skipped, optional)
+        self.assertTrue(all("gemini_calls budget of 5" in entry["reason"] for entry in usage["budget"]["skipped"]))
+
+        for section, country in skipped:
+            output = result[section] if country is None else result[section][country]
+            self.assertIn("error", output)
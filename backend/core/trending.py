@@ -0,0 +1,148 @@
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+import aiohttp
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import TrendingEntry, TrendingSync
+from .qloo import QlooAPIClient
+
+logger = logging.getLogger(__name__)
+
+# Profile domain -> Qloo entity type tracked in the trending store
+TRENDING_ENTITY_TYPES = {
+    "music": "urn:entity:artist",
+    "fashion": "urn:entity:brand",
+    "entertainment": "urn:entity:movie",
+    "places": "urn:entity:place",
+}
+
+
+def _window_days() -> int:
+    return getattr(settings, 'BRANDMAP_TRENDING_WINDOW_DAYS', 90)
+
+
+def _missing_range(country: str, entity_type: str, today: date) -> Optional[Tuple[date, date]]:
+    """Returns the days not yet in the store, up to yesterday, or None if it is current.
+
+    Only complete days are synced so a bucket never has to be re-fetched later.
+    """
+    end = today - timedelta(days=1)
+    window_start = today - timedelta(days=_window_days())
+    sync = TrendingSync.objects.filter(country=country, entity_type=entity_type).first()
+    start = window_start if sync is None else max(sync.synced_through + timedelta(days=1), window_start)
+    if start > end:
+        return None
+    return start, end
+
+
+def _store_bucket(country: str, location_id: str, entity_type: str, start: date, end: date,
+                  ranked: List[Tuple[str, str]], today: date) -> None:
+    """Saves one fetched bucket, advances the sync marker and prunes buckets outside the window."""
+    window_start = today - timedelta(days=_window_days())
+    entries = [
+        TrendingEntry(
+            country=country, entity_type=entity_type, start_date=start, end_date=end,
+            entity_id=entity_id, name=name, rank=rank,
+        )
+        for rank, (entity_id, name) in enumerate(ranked, start=1)
+    ]
+    with transaction.atomic():
+        TrendingEntry.objects.bulk_create(entries, ignore_conflicts=True)
+        TrendingSync.objects.update_or_create(
+            country=country, entity_type=entity_type,
+            defaults={"location_id": location_id, "synced_through": end},
+        )
+        TrendingEntry.objects.filter(country=country, entity_type=entity_type, end_date__lt=window_start).delete()
+
+
+def get_trending_rankings(country: str, entity_type: str, today: Optional[date] = None, limit: int = 8) -> List[str]:
+    """Ranks entities over the rolling window from the local store, without calling Qloo.
+
+    Each bucket contributes 1/rank per day it overlaps the window, so a long initial
+    bucket and a run of daily deltas are weighted consistently.
+    """
+    today = today or timezone.localdate()
+    window_start = today - timedelta(days=_window_days())
+    scores = defaultdict(float)
+    names = {}
+    entries = TrendingEntry.objects.filter(country=country, entity_type=entity_type, end_date__gte=window_start)
+    for entry in entries:
+        overlap = (min(entry.end_date, today) - max(entry.start_date, window_start)).days + 1
+        if overlap <= 0:
+            continue
+        scores[entry.entity_id] += overlap / entry.rank
+        names[entry.entity_id] = entry.name
+
+    ranked = sorted(scores, key=lambda entity_id: (-scores[entity_id], names[entity_id]))
+    return [names[entity_id] for entity_id in ranked[:limit]]
+
+
+def _parse_trending(results: List[Dict[str, Any]]) -> List[Tuple[str, str]]:
+    ranked = []
+    for item in results:
+        if isinstance(item, dict):
+            name = item.get('name') or item.get('entity', {}).get('name')
+            entity_id = item.get('entity_id') or item.get('id') or item.get('entity', {}).get('entity_id') or name
+            if name:
+                ranked.append((str(entity_id), name))
+    return ranked
+
+
+async def _refresh_entity_type(client: QlooAPIClient, session: aiohttp.ClientSession, country: str,
+                               location_id: str, entity_type: str, today: date) -> None:
+    missing = await sync_to_async(_missing_range)(country, entity_type, today)
+    if missing is None:
+        return
+
+    start, end = missing
+    results = await client.get_trending(
+        session,
+        filter_type=entity_type,
+        signal_entities=[location_id],
+        start_date=start.strftime('%Y-%m-%d'),
+        end_date=end.strftime('%Y-%m-%d'),
+        take=getattr(settings, 'BRANDMAP_TRENDING_TAKE', 20),
+    )
+    if results is None:
+        # Leave the range missing so the next refresh retries it
+        logger.warning(f"Failed to fetch trending {entity_type} data for {country} between {start} and {end}")
+        return
+
+    # An empty answer is still a successful sync; the marker advances so the range isn't re-fetched
+    ranked = _parse_trending(results)
+    await sync_to_async(_store_bucket)(country, location_id, entity_type, start, end, ranked, today)
+    logger.info(f"Synced {len(ranked)} trending {entity_type} entries for {country} ({start}..{end})")
+
+
+async def refresh_trending(client: QlooAPIClient, session: aiohttp.ClientSession, country: str, location_id: str,
+                           today: Optional[date] = None) -> None:
+    """Fetches only the days missing from the local store for every tracked entity type."""
+    today = today or timezone.localdate()
+    tasks = [
+        _refresh_entity_type(client, session, country, location_id, entity_type, today)
+        for entity_type in TRENDING_ENTITY_TYPES.values()
+    ]
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    for entity_type, result in zip(TRENDING_ENTITY_TYPES.values(), results):
+        if isinstance(result, Exception):
+            logger.error(f"Error refreshing trending {entity_type} for {country}: {result}")
+
+
+def _read_country_trending(country: str, today: date) -> Dict[str, List[str]]:
+    return {
+        domain: get_trending_rankings(country, entity_type, today)
+        for domain, entity_type in TRENDING_ENTITY_TYPES.items()
+    }
+
+
+async def get_country_trending(client: QlooAPIClient, session: aiohttp.ClientSession, country: str,
+                               location_id: str) -> Dict[str, List[str]]:
+    """Brings the store up to date with a delta fetch if needed, then ranks trending entities locally."""
+    today = timezone.localdate()
+    await refresh_trending(client, session, country, location_id, today)
+    return await sync_to_async(_read_country_trending)(country, today)
@@ -1,6 +1,8 @@
 from django.urls import path
-from .views import BrandMapAPIView
+from .views import BrandMapAPIView, BrandMapPrefetchAPIView, UsageStatsAPIView
 
 urlpatterns = [
     path('api/brandmap/', BrandMapAPIView.as_view(), name='brandmap-api'),
+    path('api/brandmap/prefetch/', BrandMapPrefetchAPIView.as_view(), name='brandmap-prefetch'),
+    path('api/brandmap/usage/', UsageStatsAPIView.as_view(), name='brandmap-usage'),
 ]
\ No newline at end of file
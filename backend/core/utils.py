@@ -1,37 +1,193 @@
 import logging
 import asyncio
+import contextvars
+import threading
+import time
+from contextlib import aclosing
 from concurrent.futures import ThreadPoolExecutor
-from typing import Dict, List, Any
+from typing import Dict, List, Any, AsyncIterator, Callable, Iterator, Optional
 import google.generativeai as genai
 from django.conf import settings
+from .admission import gemini_limiter
+from .cassettes import cassette
+from .ledger import BudgetExceeded, estimate_tokens, record_usage, reserve_call
 
 logger = logging.getLogger(__name__)
 
+GEMINI_MODEL = 'gemini-2.5-flash'
+
 # Configure the Gemini API key
 genai.configure(api_key=settings.GEMINI_API_KEY)
 
+def _record_gemini_usage(prompt: str, text: str, usage_metadata=None) -> None:
+    """Records a Gemini call's bytes and tokens, estimating tokens if Gemini reported none.
+
+    The call itself was already counted by reserve_call() before it was made.
+    """
+    input_tokens = getattr(usage_metadata, 'prompt_token_count', 0) or estimate_tokens(prompt)
+    output_tokens = getattr(usage_metadata, 'candidates_token_count', 0) or estimate_tokens(text)
+    record_usage(
+        "gemini",
+        calls=0,
+        bytes_sent=len(prompt.encode("utf-8")),
+        bytes_received=len(text.encode("utf-8")),
+        input_tokens=input_tokens,
+        output_tokens=output_tokens,
+    )
+
 def generate_gemini_response(prompt: str) -> str:
     """Generates a response from the Gemini API."""
+    cassette_request = {"model": GEMINI_MODEL, "prompt": prompt}
+    if cassette.replaying:
+        text = cassette.replay("gemini", cassette_request) or ""
+        _record_gemini_usage(prompt, text)
+        return text
+
     try:
-        model = genai.GenerativeModel('gemini-2.5-flash')
+        started = time.monotonic()
+        model = genai.GenerativeModel(GEMINI_MODEL)
         response = model.generate_content(prompt)
+        if cassette.recording:
+            cassette.save("gemini", cassette_request, response.text, time.monotonic() - started)
+        _record_gemini_usage(prompt, response.text, getattr(response, 'usage_metadata', None))
         return response.text
     except Exception as e:
         logger.error(f"Error generating response from Gemini: {e}")
+        record_usage("gemini", calls=0, bytes_sent=len(prompt.encode("utf-8")), input_tokens=estimate_tokens(prompt))
         return ""
 
-async def generate_gemini_response_async(prompt: str) -> str:
-    """Generates a response from the Gemini API asynchronously."""
-    loop = asyncio.get_event_loop()
-    with ThreadPoolExecutor(max_workers=4) as executor:
+def stream_gemini_response(prompt: str) -> Iterator[str]:
+    """Streams partial text chunks from the Gemini API as they are generated."""
+    cassette_request = {"model": GEMINI_MODEL, "prompt": prompt}
+    if cassette.replaying:
+        chunks = []
         try:
-            result = await loop.run_in_executor(executor, generate_gemini_response, prompt)
-            return result
+            for text in cassette.replay_stream("gemini", cassette_request):
+                chunks.append(text)
+                yield text
+        finally:
+            _record_gemini_usage(prompt, "".join(chunks))
+        return
+
+    started = time.monotonic()
+    model = genai.GenerativeModel(GEMINI_MODEL)
+    chunks = []
+    timings = []
+    usage_metadata = None
+    response = model.generate_content(prompt, stream=True)
+    completed = False
+    try:
+        for chunk in response:
+            # The final chunk carries the usage totals for the whole response
+            usage_metadata = getattr(chunk, 'usage_metadata', None) or usage_metadata
+            text = chunk.text
+            if text:
+                chunks.append(text)
+                timings.append((time.monotonic() - started, text))
+                yield text
+        completed = True
+    finally:
+        if not completed:
+            _cancel_gemini_stream(response)
+        _record_gemini_usage(prompt, "".join(chunks), usage_metadata)
+    if cassette.recording:
+        cassette.save("gemini", cassette_request, "".join(chunks), time.monotonic() - started, chunks=timings)
+
+def _cancel_gemini_stream(response) -> None:
+    """Stops an unfinished Gemini stream so the rest of the answer isn't generated and billed."""
+    iterator = getattr(response, '_iterator', None)
+    for name in ('cancel', 'close'):
+        stop = getattr(iterator, name, None)
+        if callable(stop):
+            try:
+                stop()
+            except Exception as e:
+                logger.warning(f"Failed to cancel Gemini stream: {e}")
+            return
+
+async def stream_gemini_response_async(prompt: str) -> AsyncIterator[str]:
+    """Async iterator over Gemini text chunks; the blocking stream is consumed in a worker thread.
+
+    If the consumer stops early or is cancelled, the worker is told to stop after
+    its current chunk and the Gemini slot is held until it has actually exited.
+    """
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue()
+    done = object()
+    stop = threading.Event()
+
+    def produce():
+        stream = stream_gemini_response(prompt)
+        try:
+            for text in stream:
+                if stop.is_set():
+                    break
+                loop.call_soon_threadsafe(chunks.put_nowait, text)
+        finally:
+            # Closing the generator cancels the upstream stream if it was cut short
+            stream.close()
+            loop.call_soon_threadsafe(chunks.put_nowait, done)
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        async with gemini_limiter:
+            reserve_call("gemini")
+            # Copy the context so usage recorded in the worker thread lands on this run's ledger
+            producer = loop.run_in_executor(executor, contextvars.copy_context().run, produce)
+            try:
+                while True:
+                    item = await chunks.get()
+                    if item is done:
+                        break
+                    yield item
+            finally:
+                stop.set()
+                await asyncio.wait({producer})
+            producer.result()
+    finally:
+        executor.shutdown(wait=False)
+
+async def generate_gemini_response_async(prompt: str, on_chunk: Optional[Callable[[str], None]] = None) -> str:
+    """Generates a response from the Gemini API asynchronously.
+
+    When on_chunk is given the response is streamed, each partial chunk is passed
+    to it as it arrives, and the aggregated text is returned. Raises BudgetExceeded
+    if the current section is optional and the run is over budget; the check runs
+    once a limiter slot is held, so it sees every call started before it.
+    """
+    if on_chunk is not None:
+        chunks = []
+        try:
+            async with aclosing(stream_gemini_response_async(prompt)) as stream:
+                async for text in stream:
+                    chunks.append(text)
+                    on_chunk(text)
+        except BudgetExceeded:
+            raise
         except Exception as e:
-            logger.error(f"Error generating async response from Gemini: {e}")
-            return ""
+            logger.error(f"Error streaming response from Gemini: {e}")
+        return "".join(chunks)
+
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        async with gemini_limiter:
+            reserve_call("gemini")
+            call = loop.run_in_executor(executor, contextvars.copy_context().run, generate_gemini_response, prompt)
+            try:
+                return await asyncio.shield(call)
+            finally:
+                # A blocking call can't be interrupted, so keep the slot until it returns
+                await asyncio.wait({call})
+    except BudgetExceeded:
+        raise
+    except Exception as e:
+        logger.error(f"Error generating async response from Gemini: {e}")
+        return ""
+    finally:
+        executor.shutdown(wait=False)
 
-async def analyze_cultural_profile_async(profile: Dict[str, Any]) -> Dict[str, Any]:
+async def analyze_cultural_profile_async(profile: Dict[str, Any], on_chunk: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
     """Analyzes a single cultural profile to extract key insights using Gemini asynchronously."""
     if not profile or profile.get('error'):
         return {"error": "Invalid or empty profile provided."}
@@ -44,10 +200,10 @@ async def analyze_cultural_profile_async(profile: Dict[str, Any]) -> Dict[str, A
     Profile:
     {profile}
     """
-    analysis_text = await generate_gemini_response_async(prompt)
+    analysis_text = await generate_gemini_response_async(prompt, on_chunk)
     return {"analysis": analysis_text}
 
-async def generate_brand_strategy_async(brand_info: Dict[str, Any], cultural_profile: Dict[str, Any]) -> Dict[str, Any]:
+async def generate_brand_strategy_async(brand_info: Dict[str, Any], cultural_profile: Dict[str, Any], on_chunk: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
     """Generates a targeted brand strategy based on cultural insights using Gemini asynchronously."""
     prompt = f"""
     Given the brand information and cultural profile below, generate a comprehensive brand strategy.
@@ -59,10 +215,10 @@ async def generate_brand_strategy_async(brand_info: Dict[str, Any], cultural_pro
     Cultural Profile:
     {cultural_profile}
     """
-    strategy_text = await generate_gemini_response_async(prompt)
+    strategy_text = await generate_gemini_response_async(prompt, on_chunk)
     return {"strategy": strategy_text}
 
-async def generate_brand_persona_async(country: str, cultural_profile: Dict[str, Any]) -> Dict[str, Any]:
+async def generate_brand_persona_async(country: str, cultural_profile: Dict[str, Any], on_chunk: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
     """Generates a brand persona for a specific country using Gemini asynchronously."""
     prompt = f"""
     Create a brand persona for {country} based on the following cultural profile.
@@ -72,20 +228,20 @@ async def generate_brand_persona_async(country: str, cultural_profile: Dict[str,
     Cultural Profile:
     {cultural_profile}
     """
-    persona_text = await generate_gemini_response_async(prompt)
+    persona_text = await generate_gemini_response_async(prompt, on_chunk)
     return {"persona": persona_text}
 
-async def perform_competitive_analysis_async(brand_name: str, competitors: List[str], country: str) -> Dict[str, Any]:
+async def perform_competitive_analysis_async(brand_name: str, competitors: List[str], country: str, on_chunk: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
     """Performs a competitive analysis using Gemini asynchronously."""
     prompt = f"""
     Analyze the competitive landscape for '{brand_name}' in {country}.
     The main competitors are: {', '.join(competitors)}.
     Provide a summary of each competitor's strengths and weaknesses, and suggest a strategy for '{brand_name}' to differentiate itself.
     """
-    analysis_text = await generate_gemini_response_async(prompt)
+    analysis_text = await generate_gemini_response_async(prompt, on_chunk)
     return {"competitive_analysis": analysis_text}
 
-async def compare_country_profiles_async(profiles: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+async def compare_country_profiles_async(profiles: Dict[str, Dict[str, Any]], on_chunk: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
     """Compares multiple country profiles to find similarities and differences using Gemini asynchronously."""
     if not profiles:
         return {"error": "No profiles to compare."}
@@ -97,7 +253,7 @@ async def compare_country_profiles_async(profiles: Dict[str, Dict[str, Any]]) ->
     Profiles:
     {profiles}
     """
-    comparison_text = await generate_gemini_response_async(prompt)
+    comparison_text = await generate_gemini_response_async(prompt, on_chunk)
     return {"comparison": comparison_text}
 
 def analyze_cultural_profile(profile: Dict[str, Any]) -> Dict[str, Any]:
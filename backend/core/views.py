@@ -1,19 +1,28 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from .serializers import BrandMapRequestSerializer
+from rest_framework.permissions import IsAdminUser
+from rest_framework.throttling import ScopedRateThrottle
+from django.http import StreamingHttpResponse
+from .serializers import BrandMapRequestSerializer, BrandMapPrefetchSerializer
 from .qloo import QlooAPIClient
+from .preview import compare_profiles_preview
+from .admission import admission_controller, preview_controller, get_request_priority, AdmissionRejected
+from .ledger import current_ledger, new_ledger, tracked, usage_totals
+from .prefetch import start_prefetch
+from .profiles import get_country_profiles_async, get_cultural_analysis_async, prefetch_country_async
 from .utils import (
-    analyze_cultural_profile_async,
     generate_brand_strategy_async,
     compare_country_profiles_async,
     generate_brand_persona_async,
     perform_competitive_analysis_async,
 )
-from typing import Dict, Any
-from datetime import datetime, timedelta
+from typing import Dict, Any, Callable, Optional
+import json
 import logging
 import asyncio
+import queue
+import threading
 import aiohttp
 from asgiref.sync import sync_to_async
 
@@ -27,11 +36,30 @@ class BrandMapAPIView(APIView):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
         brand_info = serializer.validated_data
-        
+        priority = get_request_priority(request)
+
         try:
-            # Run the async processing
-            result = asyncio.run(self._process_brand_map_async(brand_info))
+            if request.query_params.get('mode') == 'preview':
+                # Qloo-only, so previews get their own cheaper queue instead of a brand map slot
+                with preview_controller.admit(priority):
+                    result = asyncio.run(self._process_preview_async(brand_info))
+                return Response(result, status=status.HTTP_200_OK)
+
+            if request.query_params.get('stream', '').lower() in ('1', 'true', 'yes'):
+                events = admission_controller.admit_stream(self._stream_brand_map(brand_info), priority)
+                return StreamingHttpResponse(events, content_type='application/x-ndjson')
+
+            with admission_controller.admit(priority):
+                # Run the async processing
+                result = asyncio.run(self._process_brand_map_async(brand_info))
             return Response(result, status=status.HTTP_200_OK)
+        except AdmissionRejected as e:
+            logger.warning(f"Shedding brand map request: {e.reason}")
+            return Response(
+                {"error": "The server is busy. Please try again shortly.", "retry_after": e.retry_after},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": str(e.retry_after)},
+            )
         except Exception as e:
             logger.error(f"Error processing brand map: {e}")
             return Response(
@@ -39,15 +67,97 @@ class BrandMapAPIView(APIView):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
-    async def _process_brand_map_async(self, brand_info: Dict[str, Any]) -> Dict[str, Any]:
-        """Process the brand map request asynchronously."""
+    async def _process_preview_async(self, brand_info: Dict[str, Any]) -> Dict[str, Any]:
+        """Builds the preview tier: structured Qloo profiles plus a template comparison, no Gemini calls."""
+        ledger = new_ledger()
+        current_ledger.set(ledger)
+        qloo_client = QlooAPIClient()
+
+        timeout = aiohttp.ClientTimeout(total=60)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            country_profiles = await get_country_profiles_async(qloo_client, session, brand_info)
+
+        return {
+            "brand_info": brand_info,
+            "mode": "preview",
+            "country_profiles": country_profiles,
+            "comparison": compare_profiles_preview(country_profiles),
+            "metadata": {"usage": ledger.summary()},
+        }
+
+    def _stream_brand_map(self, brand_info: Dict[str, Any]):
+        """Yields newline-delimited JSON events: text deltas per section, then the full result.
+
+        The async pipeline runs on its own event loop in a worker thread and hands
+        events back through a queue, so the WSGI response can be written incrementally.
+        If the client goes away, the pipeline task is cancelled and the generator waits
+        for the worker to unwind, so the admission slot is held until upstream work stops.
+        """
+        events = queue.Queue()
+        done = object()
+        cancelled = threading.Event()
+        pipeline_lock = threading.Lock()
+        running = {}
+
+        async def pipeline():
+            with pipeline_lock:
+                if cancelled.is_set():
+                    raise asyncio.CancelledError()
+                running['loop'] = asyncio.get_running_loop()
+                running['task'] = asyncio.current_task()
+            return await self._process_brand_map_async(brand_info, emit=events.put)
+
+        def run():
+            try:
+                result = asyncio.run(pipeline())
+                events.put({"event": "result", "data": result})
+            except asyncio.CancelledError:
+                logger.info("Brand map stream cancelled after the client disconnected")
+            except Exception as e:
+                logger.error(f"Error processing brand map: {e}")
+                events.put({"event": "error", "error": "An error occurred while processing your request. Please try again."})
+            finally:
+                events.put(done)
+
+        worker = threading.Thread(target=run, daemon=True)
+        worker.start()
+        finished = False
+        try:
+            while True:
+                event = events.get()
+                if event is done:
+                    finished = True
+                    return
+                yield json.dumps(event, default=str) + "\n"
+        finally:
+            if not finished:
+                with pipeline_lock:
+                    cancelled.set()
+                    if 'task' in running:
+                        running['loop'].call_soon_threadsafe(running['task'].cancel)
+            worker.join()
+
+    @staticmethod
+    def _chunk_forwarder(emit: Optional[Callable[[Dict[str, Any]], None]], section: str, country: Optional[str] = None) -> Optional[Callable[[str], None]]:
+        """Builds an on_chunk callback that tags Gemini deltas with their section and country."""
+        if emit is None:
+            return None
+        return lambda delta: emit({"event": "delta", "section": section, "country": country, "delta": delta})
+
+    async def _process_brand_map_async(self, brand_info: Dict[str, Any], emit: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """Process the brand map request asynchronously.
+
+        If emit is given, partial Gemini output is streamed to it as delta events.
+        """
+        ledger = new_ledger()
+        current_ledger.set(ledger)
         qloo_client = QlooAPIClient()
         
         # Create aiohttp session for all requests
         timeout = aiohttp.ClientTimeout(total=60)
         async with aiohttp.ClientSession(timeout=timeout) as session:
             # Fetch cultural profiles for all target countries concurrently
-            country_profiles = await self._get_country_profiles_async(qloo_client, session, brand_info)
+            country_profiles = await get_country_profiles_async(qloo_client, session, brand_info)
 
         # Process all analyses concurrently
         tasks = []
@@ -55,7 +165,10 @@ class BrandMapAPIView(APIView):
         
         # Cultural analysis tasks
         cultural_tasks = [
-            analyze_cultural_profile_async(country_profiles.get(country, {}))
+            tracked("cultural_analysis", country, get_cultural_analysis_async(
+                country, country_profiles.get(country, {}),
+                self._chunk_forwarder(emit, "cultural_analysis", country),
+            ))
             for country in countries
         ]
         
@@ -88,18 +201,28 @@ class BrandMapAPIView(APIView):
         
         # Strategy tasks
         for country, profile in strategy_tasks:
-            all_tasks.append(generate_brand_strategy_async(brand_info, cultural_analysis.get(country, {})))
+            all_tasks.append(tracked("brand_strategies", country, generate_brand_strategy_async(
+                brand_info, cultural_analysis.get(country, {}),
+                self._chunk_forwarder(emit, "brand_strategies", country),
+            )))
         
         # Persona tasks  
         for country, profile in persona_tasks:
-            all_tasks.append(generate_brand_persona_async(country, profile))
+            all_tasks.append(tracked("brand_personas", country, generate_brand_persona_async(
+                country, profile, self._chunk_forwarder(emit, "brand_personas", country)
+            )))
         
         # Competitive tasks
         for country, competitors in competitive_tasks:
-            all_tasks.append(perform_competitive_analysis_async(brand_info['brand_name'], competitors, country))
+            all_tasks.append(tracked("competitive_analysis", country, perform_competitive_analysis_async(
+                brand_info['brand_name'], competitors, country,
+                self._chunk_forwarder(emit, "competitive_analysis", country),
+            )))
         
         # Comparison task
-        all_tasks.append(compare_country_profiles_async(cultural_analysis))
+        all_tasks.append(tracked("comparison", None, compare_country_profiles_async(
+            cultural_analysis, self._chunk_forwarder(emit, "comparison")
+        )))
 
         # Execute all remaining tasks concurrently
         results = await asyncio.gather(*all_tasks, return_exceptions=True)
@@ -145,6 +268,9 @@ class BrandMapAPIView(APIView):
         else:
             comparison = comparison_result
 
+        usage = ledger.summary()
+        logger.info(f"Upstream usage for {brand_info['brand_name']}: {usage['totals']}")
+
         return {
             "brand_info": brand_info,
             "cultural_analysis": cultural_analysis,
@@ -152,122 +278,36 @@ class BrandMapAPIView(APIView):
             "brand_personas": brand_personas,
             "competitive_analysis": competitive_analysis,
             "comparison": comparison,
+            "metadata": {"usage": usage},
         }
 
-    async def _get_country_profiles_async(self, client: QlooAPIClient, session: aiohttp.ClientSession, brand_info: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
-        """Fetches and constructs cultural profiles for each target country concurrently."""
-        tasks = [
-            self._fetch_and_build_profile_async(client, session, country)
-            for country in brand_info['target_countries']
-        ]
-        
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        profiles = {}
-        for i, country in enumerate(brand_info['target_countries']):
-            result = results[i]
-            if isinstance(result, Exception):
-                logger.error(f"Profile building failed for {country}: {result}")
-                profiles[country] = {"error": f"Failed to build profile for {country}: {str(result)}"}
-            else:
-                profiles[country] = result
-        
-        return profiles
 
-    async def _fetch_and_build_profile_async(self, client: QlooAPIClient, session: aiohttp.ClientSession, country: str) -> Dict[str, Any]:
-        """Fetches data from Qloo and builds a structured cultural profile asynchronously."""
-        try:
-            # 1. Find the location entity for the country
-            locations = await client.search_entities(session, query=country, entity_types=["urn:entity:destination", "urn:entity:locality"])
-            if not locations:
-                logger.warning(f"Could not find location information for {country}")
-                return {"error": f"Could not find location information for {country}."}
-            
-            # Get the entity ID from the first result
-            location_entity = locations[0]
-            location_id = location_entity.get('entity_id') or location_entity.get('id')
-            if not location_id:
-                logger.warning(f"No valid entity ID found for {country}")
-                return {"error": f"No valid entity ID found for {country}."}
-
-            logger.info(f"Found location ID for {country}: {location_id}")
-
-            # 2. Build the profile
-            profile = {"country": country, "location_id": location_id}
-
-            # Get insights for different entity types with location signal - run concurrently
-            entity_types = {
-                "music": "urn:entity:artist",
-                "fashion": "urn:entity:brand", 
-                "entertainment": "urn:entity:movie",
-                "places": "urn:entity:place",
-            }
-
-            # Create concurrent tasks for insights
-            insight_tasks = []
-            for domain, entity_type in entity_types.items():
-                task = client.get_insights(
-                    session,
-                    filter_type=entity_type,
-                    signal_location_query=country,
-                    take=8
-                )
-                insight_tasks.append((domain, task))
-
-            # Add demographics and trending tasks
-            demographics_task = client.get_demographics(session, signal_entities=[location_id])
-            trending_task = client.get_trending(
-                session,
-                filter_type="urn:entity:artist", 
-                signal_entities=[location_id], 
-                start_date=(datetime.now() - timedelta(days=90)).strftime('%Y-%m-%d'), 
-                end_date=datetime.now().strftime('%Y-%m-%d')
-            )
+class BrandMapPrefetchAPIView(APIView):
+    """Speculatively warms country profiles while the user is still filling in the form."""
+    throttle_classes = [ScopedRateThrottle]
+    throttle_scope = 'brandmap-prefetch'
 
-            # Execute all tasks concurrently
-            all_tasks = [task for _, task in insight_tasks] + [demographics_task, trending_task]
-            results = await asyncio.gather(*all_tasks, return_exceptions=True)
-
-            # Process insight results
-            for i, (domain, _) in enumerate(insight_tasks):
-                result = results[i]
-                if isinstance(result, Exception):
-                    logger.error(f"Error getting {domain} insights for {country}: {result}")
-                    profile[domain] = []
-                else:
-                    profile[domain] = []
-                    for item in result:
-                        if isinstance(item, dict) and 'name' in item:
-                            profile[domain].append(item['name'])
-                    logger.info(f"Got {len(profile[domain])} {domain} insights for {country}")
-
-            # Process demographics result
-            demographics_result = results[-2]
-            if isinstance(demographics_result, Exception):
-                logger.error(f"Error getting demographics for {country}: {demographics_result}")
-                profile['demographics'] = {}
-            else:
-                profile['demographics'] = demographics_result
+    def post(self, request):
+        serializer = BrandMapPrefetchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-            # Process trending result
-            trending_result = results[-1]
-            if isinstance(trending_result, Exception):
-                logger.error(f"Error getting trending data for {country}: {trending_result}")
-                profile['trending'] = {"music": []}
-            else:
-                trending_artists = []
-                if isinstance(trending_result, list):
-                    for item in trending_result:
-                        if isinstance(item, dict):
-                            name = item.get('name') or item.get('entity', {}).get('name')
-                            if name:
-                                trending_artists.append(name)
-                
-                profile['trending'] = {"music": trending_artists}
-                logger.info(f"Got {len(trending_artists)} trending artists for {country}")
-
-            return profile
+        start_prefetch(
+            serializer.validated_data['target_countries'],
+            serializer.validated_data['include_analysis'],
+            prefetch_country_async,
+        )
 
-        except Exception as e:
-            logger.error(f"Error building profile for {country}: {e}")
-            return {"error": f"Error building profile for {country}: {str(e)}"}
+        return Response(status=status.HTTP_202_ACCEPTED)
+
+
+class UsageStatsAPIView(APIView):
+    """Worker-level upstream usage and admission stats for operators."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({
+            "usage": usage_totals.snapshot(),
+            "admission": admission_controller.stats(),
+            "preview_admission": preview_controller.stats(),
+        })
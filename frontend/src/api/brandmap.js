@@ -112,6 +112,19 @@ export const submitBrandMapForm = async (formData) => {
   }
 };
 
+// Fire-and-forget: warms country profiles on the backend while the form is being filled in.
+// includeAnalysis also runs a Gemini call per country, so only ask for it once submission is likely.
+export const prefetchCountryProfiles = async (targetCountries, includeAnalysis = false) => {
+  try {
+    await api.post('/api/brandmap/prefetch/', {
+      target_countries: targetCountries,
+      include_analysis: includeAnalysis
+    });
+  } catch (error) {
+    // Prefetch is only an optimisation, the real request still works without it
+    console.warn('Prefetch failed:', error.message);
+  }
+};
 
 
 
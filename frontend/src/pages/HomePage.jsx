@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
-import { submitBrandMapForm } from '../api/brandmap';
+import { submitBrandMapForm, prefetchCountryProfiles } from '../api/brandmap';
 
 const HomePage = () => {
   const navigate = useNavigate();
@@ -73,6 +73,7 @@ const HomePage = () => {
         ...prev,
         targetCountries: [...prev.targetCountries, country]
       }));
+      prefetchCountryProfiles([country]);
     }
     setCountrySearch('');
     setShowCountryDropdown(false);
@@ -173,6 +174,8 @@ const HomePage = () => {
       }
       // Clear errors if validation passes
       setErrors({});
+      // Moving on to the final step makes a submit likely, so warm the cultural analysis too
+      prefetchCountryProfiles(formData.targetCountries, true);
     }
     
     setStep(prev => Math.min(prev + 1, 3));